@@ -1,4 +1,14 @@
 """About this package."""
 
 __version__ = "1.2.0"
-__tables__ = {"groups", "users", "floors_items", "floor_topics", "rooms", "floors", "log_entries", "items"}
+__tables__ = {
+    "groups",
+    "users",
+    "floors_items",
+    "floor_topics",
+    "rooms",
+    "floors",
+    "log_entries",
+    "items",
+    "data_versions",
+}
@@ -7,6 +7,8 @@ from rich import print as output
 from typer import Typer
 
 from museum_map.__about__ import __version__
+from museum_map.cli.aat import group as aat_group
+from museum_map.cli.benchmark import group as benchmark_group
 from museum_map.cli.db import group as db_group
 from museum_map.cli.groups import group as groups_group
 from museum_map.cli.groups import pipeline_impl as groups_pipeline
@@ -15,6 +17,9 @@ from museum_map.cli.items import group as items_group
 from museum_map.cli.items import pipeline_impl as items_pipeline
 from museum_map.cli.layout import group as layout_group
 from museum_map.cli.layout import pipeline_impl as layout_pipeline
+from museum_map.cli.logs import group as logs_group
+from museum_map.cli.publish import group as publish_group
+from museum_map.cli.publish import pipeline_impl as publish_pipeline
 from museum_map.cli.search import group as search_group
 from museum_map.cli.search import pipeline_impl as search_pipeline
 
@@ -36,6 +41,10 @@ cli.add_typer(items_group, name="items")
 cli.add_typer(groups_group, name="groups")
 cli.add_typer(layout_group, name="layout")
 cli.add_typer(search_group, name="search")
+cli.add_typer(publish_group, name="publish")
+cli.add_typer(aat_group, name="aat")
+cli.add_typer(logs_group, name="logs")
+cli.add_typer(benchmark_group, name="benchmark")
 
 
 @cli.command()
@@ -50,6 +59,7 @@ async def pipeline_impl():
     await groups_pipeline()
     await layout_pipeline()
     await search_pipeline()
+    await publish_pipeline()
 
 
 @cli.command()
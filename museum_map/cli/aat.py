@@ -0,0 +1,293 @@
+"""AAT vocabulary cache, lookup client, and CLI commands."""
+
+import asyncio
+import atexit
+import json
+import logging
+import os
+import sqlite3
+from time import monotonic
+
+import httpx
+from lxml import etree
+from rich import print as output
+from typer import Typer
+
+from museum_map.settings import settings
+
+group = Typer(help="AAT vocabulary commands")
+logger = logging.getLogger(__name__)
+
+
+class AATCache:
+    """Cache of the AAT hierarchies for category terms, backed by an append-only SQLite store."""
+
+    def __init__(self, path, batch_size=500, legacy_path="aat.json"):
+        """Initialise the cache. The store is only opened on first use."""
+        self._path = path
+        self._batch_size = batch_size
+        self._legacy_path = legacy_path
+        self._connection = None
+        self._entries = None
+        self._pending = []
+
+    def _load(self):
+        """Load all entries from the store into memory."""
+        if self._entries is None:
+            self._connection = sqlite3.connect(self._path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, hierarchies TEXT NOT NULL)"
+            )
+            self._entries = {
+                term: json.loads(hierarchies)
+                for term, hierarchies in self._connection.execute("SELECT term, hierarchies FROM terms")
+            }
+            if not self._entries and self._legacy_path and os.path.exists(self._legacy_path):
+                self.import_json(self._legacy_path)
+        return self._entries
+
+    def __contains__(self, term):
+        """Check whether the term is in the cache."""
+        return term in self._load()
+
+    def __len__(self):
+        """Return the number of cached terms."""
+        return len(self._load())
+
+    def get(self, term):
+        """Return a copy of the hierarchies for the term."""
+        return [list(hierarchy) for hierarchy in self._load()[term]]
+
+    def add(self, term, hierarchies):
+        """Add the hierarchies for a new term. Existing terms are never overwritten."""
+        entries = self._load()
+        if term not in entries:
+            entries[term] = [list(hierarchy) for hierarchy in hierarchies]
+            self._pending.append((term, json.dumps(entries[term])))
+            if len(self._pending) >= self._batch_size:
+                self.flush()
+
+    def flush(self):
+        """Write all pending entries to the store."""
+        if self._pending:
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO terms (term, hierarchies) VALUES (?, ?)", self._pending
+                )
+            self._pending = []
+
+    def import_json(self, path):
+        """Import the terms from a JSON file. Returns the number of new terms."""
+        with open(path) as in_f:
+            terms = json.load(in_f)
+        entries = self._load()
+        count = len(entries)
+        for term, hierarchies in terms.items():
+            self.add(term, hierarchies)
+        self.flush()
+        return len(entries) - count
+
+    def export_json(self, path):
+        """Export all terms to a JSON file. Returns the number of terms."""
+        entries = self._load()
+        with open(path, "w") as out_f:
+            json.dump(entries, out_f)
+        return len(entries)
+
+
+def parse_hierarchy(text):
+    """Parse an AAT hierarchy string into a list of normalised terms."""
+    hierarchy = []
+    for entry in [h.strip() for h in text.split("|") if "<" not in h]:
+        entry = entry.lower()  # noqa: PLW2901
+        if "(" in entry:
+            entry = entry[: entry.find("(")].strip()  # noqa: PLW2901
+        if entry.endswith(" facet"):
+            entry = entry[: entry.find(" facet")].strip()  # noqa: PLW2901
+        if entry.endswith(" genres"):
+            entry = entry[: entry.find(" genres")].strip()  # noqa: PLW2901
+        if entry not in hierarchy:
+            hierarchy.append(entry)
+    return hierarchy
+
+
+class GettyBackend:
+    """Look up terms using the Getty AAT web service."""
+
+    def __init__(self, url, concurrency=8, rate_limit=10.0, retries=3, backoff=1.0, timeout=300.0):
+        """Initialise the backend."""
+        self._url = url.rstrip("/")
+        self._concurrency = concurrency
+        self._interval = 1 / rate_limit if rate_limit else 0
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._client = None
+        self._semaphore = None
+        self._rate_lock = None
+        self._last_request = 0
+
+    async def open(self):
+        """Open the connection pool."""
+        self._client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self._concurrency, max_keepalive_connections=self._concurrency),
+            timeout=self._timeout,
+        )
+        self._semaphore = asyncio.Semaphore(self._concurrency)
+        self._rate_lock = asyncio.Lock()
+
+    async def close(self):
+        """Close the connection pool."""
+        await self._client.aclose()
+        self._client = None
+
+    async def _get(self, method, params):
+        """Send a rate-limited request, retrying failed requests and raising an error if all retries failed."""
+        async with self._semaphore:
+            for attempt in range(self._retries + 1):
+                async with self._rate_lock:
+                    delay = self._last_request + self._interval - monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    self._last_request = monotonic()
+                try:
+                    response = await self._client.get(f"{self._url}/{method}", params=params)
+                    if response.status_code != 429 and response.status_code < 500:  # noqa: PLR2004
+                        response.raise_for_status()
+                        return response
+                    logger.warning(f"AAT request {method} failed with status {response.status_code}")
+                except httpx.TransportError as e:
+                    if attempt == self._retries:
+                        raise
+                    logger.warning(f"AAT request {method} failed: {e}")
+                if attempt < self._retries:
+                    await asyncio.sleep(self._backoff * 2**attempt)
+            msg = f"AAT request {method} failed with status {response.status_code} after {self._retries} retries"
+            raise httpx.HTTPStatusError(msg, request=response.request, response=response)
+
+    async def _subject_hierarchy(self, subject):
+        """Fetch the hierarchy for a single subject."""
+        response = await self._get("AATGetSubject", [("subjectID", subject)])
+        hierarchy_text = etree.fromstring(response.content).xpath("Subject/Hierarchy/text()")  # noqa: S320
+        if hierarchy_text:
+            return parse_hierarchy(hierarchy_text[0])
+        return None
+
+    async def lookup(self, term):
+        """Look up the hierarchies for the term."""
+        response = await self._get("AATGetTermMatch", [("term", f'"{term}"'), ("logop", "and"), ("notes", "")])
+        subjects = etree.fromstring(response.content).xpath("Subject/Subject_ID/text()")  # noqa: S320
+        hierarchies = await asyncio.gather(*[self._subject_hierarchy(subject) for subject in subjects])
+        return [hierarchy for hierarchy in hierarchies if hierarchy is not None]
+
+
+class FileBackend:
+    """Look up terms in a local JSON file, using the same format as the cache export."""
+
+    def __init__(self, path):
+        """Initialise the backend."""
+        self._path = path
+        self._terms = None
+
+    async def open(self):
+        """Load the terms from the file."""
+        if self._terms is None:
+            with open(self._path) as in_f:
+                self._terms = json.load(in_f)
+
+    async def close(self):
+        """Nothing needs closing for the file backend."""
+
+    async def lookup(self, term):
+        """Look up the hierarchies for the term."""
+        return self._terms.get(term, [])
+
+
+class AATClient:
+    """Client for looking up AAT terms, which stores all results in the cache."""
+
+    def __init__(self, cache, backend):
+        """Initialise the client."""
+        self._cache = cache
+        self._backend = backend
+        self._in_flight = {}
+        self._backend_lock = None
+        self._backend_open = False
+
+    async def __aenter__(self):
+        """Use the client. The backend is only opened when the first term needs fetching."""
+        # The lock is bound to the running event loop, so it is created each time the client is used
+        self._backend_lock = asyncio.Lock()
+        self._in_flight = {}
+        return self
+
+    async def __aexit__(self, *args):
+        """Close the backend and flush the cache."""
+        if self._backend_open:
+            await self._backend.close()
+            self._backend_open = False
+        self._cache.flush()
+
+    async def _fetch(self, term):
+        """Fetch the term from the backend and cache it and all its ancestor terms. Failed lookups are not cached."""
+        async with self._backend_lock:
+            if not self._backend_open:
+                await self._backend.open()
+                self._backend_open = True
+        hierarchies = await self._backend.lookup(term)
+        self._cache.add(term, hierarchies)
+        for hierarchy in hierarchies:
+            for start in range(0, len(hierarchy)):
+                if hierarchy[start + 1 :]:
+                    self._cache.add(hierarchy[start], [hierarchy[start + 1 :]])
+                else:
+                    self._cache.add(hierarchy[start], [])
+
+    async def lookup(self, term):
+        """Look up the hierarchies for the term. Concurrent lookups of the same term share a single request."""
+        if term not in self._cache:
+            if term not in self._in_flight:
+                self._in_flight[term] = asyncio.ensure_future(self._fetch(term))
+                self._in_flight[term].add_done_callback(lambda _: self._in_flight.pop(term, None))
+            await asyncio.shield(self._in_flight[term])
+        return self._cache.get(term)
+
+    async def prefetch(self, terms):
+        """Look up all terms that are not yet cached concurrently, raising the first error once all have finished."""
+        results = await asyncio.gather(
+            *[self.lookup(term) for term in set(terms) if term not in self._cache], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+
+def create_backend(aat_settings):
+    """Create the lookup backend configured in the settings."""
+    if aat_settings.backend == "file":
+        return FileBackend(aat_settings.path)
+    return GettyBackend(
+        aat_settings.url,
+        concurrency=aat_settings.concurrency,
+        rate_limit=aat_settings.rate_limit,
+        retries=aat_settings.retries,
+        backoff=aat_settings.backoff,
+        timeout=aat_settings.timeout,
+    )
+
+
+cache = AATCache(settings.data.hierarchy.aat.cache)
+atexit.register(cache.flush)
+client = AATClient(cache, create_backend(settings.data.hierarchy.aat))
+
+
+@group.command()
+def import_cache(source: str):
+    """Import AAT terms from a JSON file into the cache."""
+    output(f"Imported {cache.import_json(source)} new terms")
+
+
+@group.command()
+def export_cache(target: str):
+    """Export the cached AAT terms to a JSON file."""
+    output(f"Exported {cache.export_json(target)} terms")
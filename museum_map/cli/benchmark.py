@@ -0,0 +1,97 @@
+"""Benchmark CLI commands."""
+
+from time import perf_counter
+
+import numpy as np
+from rich import print as output
+from rich.table import Table
+from scipy.spatial.distance import cosine
+from typer import Typer
+
+from museum_map.cli.similarity import similarity_chain
+from museum_map.search import EmbeddedIndex, current_embedded_version
+from museum_map.settings import settings
+
+group = Typer(help="Benchmark commands")
+
+
+def reference_similarity_order(vectors):
+    """Order the vectors using the original pair-wise greedy chain."""
+    sorted_items = []
+    current = 0
+    while len(sorted_items) < len(vectors):
+        next_item = None
+        next_sim = None
+        for item in range(len(vectors)):
+            if item in sorted_items:
+                continue
+            if next_item is None or cosine(vectors[current], vectors[item]) > next_sim:
+                next_item = item
+                next_sim = cosine(vectors[current], vectors[item])
+        if next_item is not None:
+            sorted_items.append(next_item)
+    return sorted_items
+
+
+def generate_vectors(rng, count, dimensions):
+    """Generate a set of sparse topic vectors, including outlier and duplicate vectors."""
+    vectors = np.zeros((count, dimensions))
+    topics = rng.integers(0, dimensions, count)
+    vectors[np.arange(count), topics] = rng.random(count)
+    vectors[rng.random(count) < 0.1] = 0  # noqa: PLR2004
+    duplicates = rng.integers(0, count, count // 10)
+    vectors[rng.integers(0, count, count // 10)] = vectors[duplicates]
+    return vectors
+
+
+@group.command()
+def order_items(rooms: int = 10, items: int = 250, dimensions: int = 100, seed: int = 0):
+    """Compare the vectorised item ordering against the original implementation."""
+    rng = np.random.default_rng(seed)
+    matrices = [generate_vectors(rng, items, dimensions) for _ in range(rooms)]
+    start = perf_counter()
+    with np.errstate(invalid="ignore"):
+        reference = [reference_similarity_order(list(matrix)) for matrix in matrices]
+    reference_time = perf_counter() - start
+    start = perf_counter()
+    vectorised = [list(similarity_chain(matrix)[0]) for matrix in matrices]
+    vectorised_time = perf_counter() - start
+    table = Table(title=f"Ordering {rooms} rooms with {items} items")
+    table.add_column("Implementation")
+    table.add_column("Total (s)", justify="right")
+    table.add_column("Per room (ms)", justify="right")
+    table.add_row("Pair-wise", f"{reference_time:.3f}", f"{reference_time / rooms * 1000:.2f}")
+    table.add_row("Vectorised", f"{vectorised_time:.3f}", f"{vectorised_time / rooms * 1000:.2f}")
+    output(table)
+    if reference == vectorised:
+        output("[green]Both implementations generate identical sequences[/green]")
+    else:
+        output("[red]The implementations generate different sequences[/red]")
+
+
+@group.command()
+def search(queries: list[str], repeat: int = 100):
+    """Time the floor and room facet and the room item queries against the embedded search index."""
+    version = current_embedded_version(settings.search.path)
+    if version is None:
+        output("[red]No embedded search index has been built[/red]")
+        return
+    index = EmbeddedIndex(settings.search.path, version)
+    table = Table(title=f"Embedded search index {version}")
+    table.add_column("Query")
+    table.add_column("Rooms", justify="right")
+    table.add_column("Facets (ms)", justify="right")
+    table.add_column("Room items (ms)", justify="right")
+    for q in queries:
+        start = perf_counter()
+        for _ in range(repeat):
+            facets = index.facets(q)
+        facets_time = (perf_counter() - start) / repeat
+        room_time = 0
+        if facets["rooms"]:
+            start = perf_counter()
+            for _ in range(repeat):
+                index.room_items(facets["rooms"][0], q, 150)
+            room_time = (perf_counter() - start) / repeat
+        table.add_row(q, str(len(facets["rooms"])), f"{facets_time * 1000:.3f}", f"{room_time * 1000:.3f}")
+    output(table)
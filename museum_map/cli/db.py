@@ -3,11 +3,26 @@
 import asyncio
 import json
 import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from itertools import chain
 
+from rich import print as output
 from rich.progress import Progress
+from sqlalchemy import JSON, bindparam, cast, func, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB
 from typer import Typer
 
-from museum_map.models import Base, Item, async_engine, async_sessionmaker
+from museum_map.cli.logs import ensure_partitions
+from museum_map.cli.util import keyset_batches, worker_count
+from museum_map.models import Base, Item, async_engine, async_sessionmaker, encode_vector, ensure_data_version
+from museum_map.settings import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 group = Typer(help="Database commands")
 
@@ -18,6 +33,8 @@ async def init_impl(drop_existing: bool):  # noqa: FBT001
         if drop_existing:
             await conn.run_sync(Base.metadata.drop_all)
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_partitions(conn, settings.tracking.partitions_ahead)
+        await ensure_data_version(conn)
 
 
 @group.command()
@@ -26,28 +43,345 @@ def init(drop_existing: bool = False):  # noqa: FBT001, FBT002
     asyncio.run(init_impl(drop_existing))
 
 
-async def load_impl(source: str):
-    """Load the metadata."""
+CREATE_STAGING = (
+    "CREATE TEMPORARY TABLE IF NOT EXISTS items_staging "
+    "(source_key VARCHAR, content_hash VARCHAR(64), attributes JSON) ON COMMIT DELETE ROWS"
+)
+# Only rows that are new, changed, or were deleted are written and returned, together with whether they were inserted
+# and whether they are placed in a room. Updated items whose categories ($1) changed are removed from their group.
+# The derived attributes, whose names start with an underscore, are kept until they are recomputed from the new source
+UPSERT_ITEMS = (
+    "INSERT INTO items (source_key, content_hash, attributes, deleted) "
+    "SELECT source_key, content_hash, attributes, false FROM items_staging "
+    "ON CONFLICT (source_key) DO UPDATE "
+    "SET content_hash = EXCLUDED.content_hash, "
+    "attributes = (COALESCE((SELECT jsonb_object_agg(key, value) FROM jsonb_each(items.attributes::JSONB) "
+    "WHERE left(key, 1) = '_'), '{}'::JSONB) || EXCLUDED.attributes::JSONB)::JSON, deleted = false, "
+    "group_id = CASE WHEN items.attributes::JSONB -> $1::VARCHAR IS DISTINCT FROM "
+    "EXCLUDED.attributes::JSONB -> $1::VARCHAR THEN NULL ELSE items.group_id END, "
+    "room_id = CASE WHEN items.attributes::JSONB -> $1::VARCHAR IS DISTINCT FROM "
+    "EXCLUDED.attributes::JSONB -> $1::VARCHAR THEN NULL ELSE items.room_id END "
+    "WHERE items.content_hash IS DISTINCT FROM EXCLUDED.content_hash OR items.deleted "
+    "RETURNING id, xmax = 0, room_id IS NOT NULL"
+)
+MARK_DELETED = (
+    "UPDATE items SET deleted = true, group_id = NULL, room_id = NULL "
+    "WHERE NOT deleted AND source_key = ANY($1::VARCHAR[]) RETURNING id"
+)
+MARK_UNMATCHED_DELETED = (
+    "UPDATE items SET deleted = true, group_id = NULL, room_id = NULL WHERE id = ANY($1::INTEGER[])"
+)
+# Room and floor samples must be items that are still in the room or on the floor
+REPLACE_ROOM_SAMPLES = (
+    "UPDATE rooms SET item_id = (SELECT id FROM items WHERE items.room_id = rooms.id ORDER BY random() LIMIT 1) "
+    "WHERE item_id IS NOT NULL AND NOT EXISTS "
+    "(SELECT 1 FROM items WHERE items.id = rooms.item_id AND items.room_id = rooms.id) RETURNING id"
+)
+REMOVE_FLOOR_SAMPLES = (
+    "DELETE FROM floors_items USING items "
+    "WHERE items.id = floors_items.item_id AND items.room_id IS NULL RETURNING floors_items.item_id"
+)
+
+
+async def replace_samples(connection) -> tuple[int, int]:
+    """Replace the room samples and remove the floor samples that are no longer placed in their room."""
+    rooms = await connection.fetch(REPLACE_ROOM_SAMPLES)
+    floor_samples = await connection.fetch(REMOVE_FLOOR_SAMPLES)
+    return len(rooms), len(floor_samples)
+
+
+def scan_files(source: str, progress: Progress) -> list[str]:
+    """Find all metadata files in the source directory, returning their paths relative to it as source keys."""
+    task = progress.add_task("Scanning files", total=None)
+    keys = []
+    for basepath, _, filenames in os.walk(source):
+        for filename in filenames:
+            if filename.endswith(".json"):
+                keys.append(os.path.relpath(os.path.join(basepath, filename), source).replace(os.sep, "/"))
+        progress.update(task, completed=len(keys))
+    progress.update(task, total=len(keys), completed=len(keys))
+    return keys
+
+
+def parse_files(source: str, keys: list[str], known_hashes: list[str | None]) -> tuple[list[tuple], int, list[str]]:
+    """Hash the files and parse the ones that differ from their known hash, returning the records to load."""
+    records = []
+    unchanged = 0
+    invalid = []
+    for key, known_hash in zip(keys, known_hashes, strict=True):
+        try:
+            with open(os.path.join(source, key), "rb") as in_f:
+                data = in_f.read()
+            content_hash = sha256(data).hexdigest()
+            if content_hash == known_hash:
+                unchanged = unchanged + 1
+            elif orjson is not None:
+                records.append((key, content_hash, orjson.dumps(orjson.loads(data)).decode("utf-8")))
+            else:
+                records.append(
+                    (key, content_hash, json.dumps(json.loads(data), ensure_ascii=False, separators=(",", ":")))
+                )
+        except (OSError, ValueError):
+            invalid.append(key)
+    return records, unchanged, invalid
+
+
+async def load_impl(
+    source: str,
+    workers: int = 0,
+    batch_size: int = 1000,
+    changes: str = "changes.json",
+    mark_deleted: bool = True,  # noqa: FBT001, FBT002
+):
+    """Load new and changed metadata files, mark the items of removed files as deleted, and write the change set."""
+    workers = worker_count(workers)
+    async with async_sessionmaker() as dbsession:
+        legacy_stmt = select(func.count(Item.id)).filter(Item.source_key.is_(None), Item.deleted.is_(False))
+        legacy = (await dbsession.execute(legacy_stmt)).scalar_one()
+    if legacy > 0:
+        output(
+            f"[red]{legacy} items were loaded without a source key and would be loaded again as new items. "
+            "Run db migrate-sources with the metadata directory or reload from scratch with db init --drop-existing"
+            "[/red]"
+        )
+        return
+    with Progress() as progress:
+        keys = scan_files(source, progress)
+        async with async_sessionmaker() as dbsession:
+            query = select(Item.source_key, Item.content_hash).filter(
+                Item.source_key.is_not(None), Item.deleted.is_(False)
+            )
+            known = dict((await dbsession.execute(query)).all())
+        task = progress.add_task("Loading files", total=len(keys))
+        added = []
+        updated = []
+        deleted = []
+        unplaced = []
+        invalid = []
+        unchanged = 0
+        replaced = (0, 0)
+        loop = asyncio.get_running_loop()
+        # Files are hashed and parsed in worker processes, while the parsed batches are upserted in order
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            async with async_engine.connect() as conn:
+                connection = (await conn.get_raw_connection()).driver_connection
+                await connection.execute(CREATE_STAGING)
+                for start in range(0, len(keys), batch_size):
+                    batch = keys[start : start + batch_size]
+                    pending.append(
+                        loop.run_in_executor(executor, parse_files, source, batch, [known.get(key) for key in batch])
+                    )
+                    while len(pending) > workers * 2 or (pending and start + batch_size >= len(keys)):
+                        records, batch_unchanged, batch_invalid = await pending.popleft()
+                        if records:
+                            async with connection.transaction():
+                                await connection.copy_records_to_table("items_staging", records=records)
+                                for item_id, inserted, placed in await connection.fetch(
+                                    UPSERT_ITEMS, settings.data.hierarchy.field
+                                ):
+                                    (added if inserted else updated).append(item_id)
+                                    if not placed:
+                                        unplaced.append(item_id)
+                        unchanged = unchanged + batch_unchanged
+                        invalid.extend(batch_invalid)
+                        progress.update(task, advance=len(records) + batch_unchanged + len(batch_invalid))
+                if mark_deleted and keys:
+                    removed = list(set(known) - set(keys))
+                    deleted = [row[0] for row in await connection.fetch(MARK_DELETED, removed)]
+                if deleted or updated:
+                    replaced = await replace_samples(connection)
+    if mark_deleted and not keys:
+        output("[red]No metadata files found, no items were marked as deleted[/red]")
+    with open(f"{changes}.tmp", "w") as out_f:
+        json.dump(
+            {
+                "added": sorted(added),
+                "updated": sorted(updated),
+                "deleted": sorted(deleted),
+                "unplaced": sorted(unplaced),
+            },
+            out_f,
+        )
+    os.replace(f"{changes}.tmp", changes)
+    output(
+        f"Added {len(added)}, updated {len(updated)}, and deleted {len(deleted)} items, "
+        f"{unchanged} items are unchanged. The change set was written to {changes}"
+    )
+    if replaced != (0, 0):
+        output(f"Replaced the samples of {replaced[0]} rooms and removed {replaced[1]} floor samples")
+    if unplaced:
+        output(
+            f"[yellow]{len(unplaced)} new items or items with changed categories are not placed in a room. "
+            "Run items expand-categories with the change set, then the groups and layout pipelines to place them, "
+            "before search index[/yellow]"
+        )
+    if invalid:
+        output(f"[red]Skipped {len(invalid)} invalid files[/red]")
+        for key in invalid[:10]:
+            output(f"[red]  {key}[/red]")
+
+
+@group.command()
+def load(
+    source: str,
+    workers: int = 0,
+    batch_size: int = 1000,
+    changes: str = "changes.json",
+    mark_deleted: bool = True,  # noqa: FBT001, FBT002
+):
+    """Load new and changed metadata files, mark the items of removed files as deleted, and write the change set."""
+    asyncio.run(load_impl(source, workers, batch_size, changes, mark_deleted))
+
+
+def source_fingerprint(attributes: dict) -> str:
+    """Hash the attributes loaded from the metadata file, ignoring the attributes added by the later stages."""
+    loaded = {key: value for key, value in attributes.items() if not key.startswith("_") and key != "lda_vector"}
+    return sha256(
+        json.dumps(loaded, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def fingerprint_files(source: str, keys: list[str]) -> tuple[list[tuple], list[str]]:
+    """Hash the files and fingerprint their parsed attributes, returning the records and the invalid files."""
+    records = []
+    invalid = []
+    for key in keys:
+        try:
+            with open(os.path.join(source, key), "rb") as in_f:
+                data = in_f.read()
+            attributes = orjson.loads(data) if orjson is not None else json.loads(data)
+            records.append((key, sha256(data).hexdigest(), source_fingerprint(attributes)))
+        except (OSError, ValueError):
+            invalid.append(key)
+    return records, invalid
+
+
+async def migrate_sources_impl(
+    source: str,
+    workers: int = 0,
+    batch_size: int = 1000,
+    mark_deleted: bool = True,  # noqa: FBT001, FBT002
+):
+    """Add the source tracking columns and match the existing items to their metadata files in the source."""
+    workers = worker_count(workers)
+    async with async_engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE items ADD COLUMN IF NOT EXISTS source_key VARCHAR"))
+        await conn.execute(text("ALTER TABLE items ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)"))
+        await conn.execute(text("ALTER TABLE items ADD COLUMN IF NOT EXISTS deleted BOOLEAN NOT NULL DEFAULT false"))
+        await conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_items_source_key ON items (source_key)"))
+    items = Item.__table__
+    update_stmt = (
+        update(items)
+        .where(items.c.id == bindparam("item_id"))
+        .values(source_key=bindparam("key"), content_hash=bindparam("hash"))
+    )
+    with Progress() as progress:
+        # Items without a source key are matched by their loaded attributes, with duplicates matched in id order
+        legacy = defaultdict(deque)
+        async with async_sessionmaker() as dbsession:
+            count_stmt = select(func.count(Item.id)).filter(Item.source_key.is_(None), Item.deleted.is_(False))
+            count = (await dbsession.execute(count_stmt)).scalar_one()
+            task = progress.add_task("Fingerprinting existing items", total=count)
+            stmt = select(Item.id, Item.attributes).filter(Item.source_key.is_(None), Item.deleted.is_(False))
+            async for rows in keyset_batches(dbsession, stmt, Item.id, batch_size):
+                for item_id, attributes in rows:
+                    legacy[source_fingerprint(attributes)].append(item_id)
+                progress.update(task, advance=len(rows))
+            known = set(
+                (await dbsession.execute(select(Item.source_key).filter(Item.source_key.is_not(None)))).scalars()
+            )
+        keys = [key for key in scan_files(source, progress) if key not in known]
+        task = progress.add_task("Matching files", total=len(keys))
+        matched = 0
+        unmatched_files = 0
+        invalid = []
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = [
+                loop.run_in_executor(executor, fingerprint_files, source, keys[start : start + batch_size])
+                for start in range(0, len(keys), batch_size)
+            ]
+            async with async_sessionmaker() as dbsession:
+                for batch in batches:
+                    records, batch_invalid = await batch
+                    params = []
+                    for key, content_hash, fingerprint in records:
+                        if legacy.get(fingerprint):
+                            params.append({"item_id": legacy[fingerprint].popleft(), "key": key, "hash": content_hash})
+                        else:
+                            unmatched_files = unmatched_files + 1
+                    if params:
+                        await dbsession.execute(update_stmt, params)
+                        await dbsession.commit()
+                    matched = matched + len(params)
+                    invalid.extend(batch_invalid)
+                    progress.update(task, advance=len(records) + len(batch_invalid))
+    unmatched = sorted(chain.from_iterable(legacy.values()))
+    output(
+        f"Matched {matched} items to their metadata files, {unmatched_files} files have no matching item "
+        "and will be added by the next db load"
+    )
+    if unmatched and mark_deleted:
+        async with async_engine.begin() as conn:
+            connection = (await conn.get_raw_connection()).driver_connection
+            await connection.execute(MARK_UNMATCHED_DELETED, unmatched)
+            rooms, floor_samples = await replace_samples(connection)
+        output(f"[red]Marked {len(unmatched)} items without a metadata file as deleted[/red]")
+        output(f"Replaced the samples of {rooms} rooms and removed {floor_samples} floor samples")
+    elif unmatched:
+        output(
+            f"[red]{len(unmatched)} items have no metadata file. db load will not run until they are matched "
+            "or marked as deleted[/red]"
+        )
+    if invalid:
+        output(f"[red]Skipped {len(invalid)} invalid files[/red]")
+        for key in invalid[:10]:
+            output(f"[red]  {key}[/red]")
+
+
+@group.command()
+def migrate_sources(
+    source: str,
+    workers: int = 0,
+    batch_size: int = 1000,
+    mark_deleted: bool = True,  # noqa: FBT001, FBT002
+):
+    """Add the source tracking columns and match the existing items to their metadata files in the source."""
+    asyncio.run(migrate_sources_impl(source, workers, batch_size, mark_deleted))
+
+
+async def migrate_vectors_impl(batch_size: int = 1000):
+    """Move the topic vectors from the item attributes into the binary topic vector column."""
+    async with async_engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE items ADD COLUMN IF NOT EXISTS topic_vector BYTEA"))
+    items = Item.__table__
+    update_stmt = (
+        update(items)
+        .where(items.c.id == bindparam("item_id"))
+        .values(
+            topic_vector=bindparam("vector"),
+            attributes=cast(cast(items.c.attributes, JSONB).op("-")("lda_vector"), JSON),
+        )
+    )
     with Progress() as progress:
-        task = progress.add_task("Scanning files", total=None)
-        total = 0
-        for _basepath, _, filenames in os.walk(source):
-            for filename in filenames:
-                if filename.endswith(".json"):
-                    total = total + 1
-        progress.update(task, total=total, completed=total)
-        task = progress.add_task("Loading files", total=total)
         async with async_sessionmaker() as dbsession:
-            for basepath, _, filenames in os.walk(source):
-                for filename in filenames:
-                    if filename.endswith(".json"):
-                        with open(os.path.join(basepath, filename)) as in_f:
-                            dbsession.add(Item(attributes=json.load(in_f)))
-                            progress.update(task, advance=1)
-                await dbsession.commit()
+            count = (await dbsession.execute(select(func.count(Item.id)))).scalar_one()
+            task = progress.add_task("Migrating topic vectors", total=count)
+            stmt = select(Item.id, Item.attributes["lda_vector"])
+            async for rows in keyset_batches(dbsession, stmt, Item.id, batch_size):
+                params = [
+                    {"item_id": item_id, "vector": encode_vector(vector)}
+                    for item_id, vector in rows
+                    if vector is not None
+                ]
+                if params:
+                    await dbsession.execute(update_stmt, params)
+                    await dbsession.commit()
+                progress.update(task, advance=len(rows))
 
 
 @group.command()
-def load(source: str):
-    """Load the metadata."""
-    asyncio.run(load_impl(source))
+def migrate_vectors(batch_size: int = 1000):
+    """Move the topic vectors from the item attributes into the binary topic vector column."""
+    asyncio.run(migrate_vectors_impl(batch_size))
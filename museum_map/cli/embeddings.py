@@ -0,0 +1,71 @@
+"""Document embedding cache for the topic modelling."""
+
+import hashlib
+import sqlite3
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+
+def document_hash(document):
+    """Calculate the hash that identifies the document's text."""
+    return hashlib.sha256(document.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache of document embeddings, keyed by the embedding model and the document hash and backed by SQLite."""
+
+    def __init__(self, path, model_name, batch_size=500):
+        """Initialise the cache. The store and the embedding model are only opened on first use."""
+        self._path = path
+        self._model_name = model_name
+        self._batch_size = batch_size
+        self._connection = None
+        self._model = None
+
+    def _connect(self):
+        """Open the store."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(model TEXT NOT NULL, hash TEXT NOT NULL, vector BLOB NOT NULL, PRIMARY KEY (model, hash))"
+            )
+        return self._connection
+
+    def _fetch(self, hashes):
+        """Fetch the stored embeddings for the hashes, in batches to stay below the SQLite parameter limit."""
+        connection = self._connect()
+        hashes = list(set(hashes))
+        embeddings = {}
+        for start in range(0, len(hashes), self._batch_size):
+            batch = hashes[start : start + self._batch_size]
+            placeholders = ", ".join("?" * len(batch))
+            for key, vector in connection.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",  # noqa: S608
+                [self._model_name, *batch],
+            ):
+                embeddings[key] = np.frombuffer(vector, dtype=np.float32)
+        return embeddings
+
+    def missing(self, hashes):
+        """Return the distinct hashes that have no stored embedding, in their original order."""
+        stored = self._fetch(hashes)
+        return [key for key in dict.fromkeys(hashes) if key not in stored]
+
+    def encode(self, hashes, documents):
+        """Embed the documents and store the embeddings under their hashes."""
+        if self._model is None:
+            self._model = SentenceTransformer(self._model_name)
+        embeddings = np.asarray(self._model.encode(documents, show_progress_bar=False), dtype=np.float32)
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(self._model_name, key, vector.tobytes()) for key, vector in zip(hashes, embeddings, strict=True)],
+            )
+
+    def get(self, hashes):
+        """Return the embeddings for the hashes as a single matrix."""
+        embeddings = self._fetch(hashes)
+        return np.array([embeddings[key] for key in hashes], dtype=np.float32)
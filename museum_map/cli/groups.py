@@ -1,20 +1,22 @@
 """Group generation CLI commands."""
 
 import asyncio
+import heapq
 import math
 from collections import Counter
 
 import inflection
-from numpy import array
+from numpy import float32, split
 from rich.progress import Progress, track
-from scipy.spatial.distance import cosine
-from sqlalchemy import and_, func, or_
+from sqlalchemy import and_, func, or_, update
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from typer import Typer
 
+from museum_map.cli.aat import client as aat_client
 from museum_map.cli.items import apply_aat, apply_nlp
-from museum_map.models import Group, Item, async_sessionmaker
+from museum_map.cli.similarity import similarity_chain, stack_vectors
+from museum_map.models import Group, Item, async_sessionmaker, load_vectors
 from museum_map.settings import settings
 
 group = Typer(help="Generate group commands")
@@ -23,46 +25,73 @@ group = Typer(help="Generate group commands")
 async def generate_groups_impl():
     """Generate the basic groups."""
     async with async_sessionmaker() as dbsession:
-        item_stmt = select(Item).filter(Item.group_id == None)  # noqa: E711
-        count_stmt = select(func.count(Item.id)).filter(Item.group_id == None)  # noqa: E711
+        count_stmt = select(func.count(Item.id)).filter(Item.group_id == None, Item.deleted.is_(False))  # noqa: E711
         count = await dbsession.execute(count_stmt)
+        item_stmt = (
+            select(Item.id, Item.attributes["_categories"])
+            .filter(Item.group_id == None, Item.deleted.is_(False))  # noqa: E711
+            .order_by(Item.id)
+        )
         result = await dbsession.execute(item_stmt)
-        categories = []
-        for item in track(result.scalars(), total=count.scalar_one(), description="Generating potential groups"):
-            for category in item.attributes["_categories"]:
-                categories.append(category.lower())
-        counts = [(cat, count) for cat, count in Counter(categories).most_common() if count >= 15]  # noqa: PLR2004
-        counts.sort(key=lambda c: c[1])
-        max_groups = len(counts)
+        item_categories = {}
+        category_items = {}
+        counts = Counter()
+        for item_id, categories in track(result, total=count.scalar_one(), description="Generating potential groups"):
+            item_categories[item_id] = [category.lower() for category in categories]
+            for category in item_categories[item_id]:
+                counts[category] = counts[category] + 1
+                if category not in category_items:
+                    category_items[category] = []
+                if category_items[category][-1:] != [item_id]:
+                    category_items[category].append(item_id)
+        assignments = {}
+        first_unassigned = dict.fromkeys(category_items, 0)
+
+        def candidate(category):
+            """Build the candidate entry, with ties ordered by the first occurrence in the unassigned items."""
+            items = category_items[category]
+            while items[first_unassigned[category]] in assignments:
+                first_unassigned[category] = first_unassigned[category] + 1
+            item_id = items[first_unassigned[category]]
+            return (counts[category], item_id, item_categories[item_id].index(category), category)
+
+        candidates = [candidate(category) for category, count in counts.items() if count >= 15]  # noqa: PLR2004
+        heapq.heapify(candidates)
+        result = await dbsession.execute(select(Group).order_by(Group.id))
+        groups = {}
+        for group in result.scalars():
+            if group.value not in groups:
+                groups[group.value] = group
         with Progress() as progress:
-            task = progress.add_task("Generating groups", total=max_groups)
-            while counts:
-                category = counts[0][0]
-                group_stmt = select(Group).filter(Group.value == category)
-                result = await dbsession.execute(group_stmt)
-                group = result.scalars().first()
-                if group is None:
-                    group = Group(value=category, label=category[0].upper() + category[1:], split="basic")
-                    dbsession.add(group)
-                result = await dbsession.execute(item_stmt)
-                for item in result.scalars():
-                    if category in item.attributes["_categories"]:
-                        item.group = group
-                await dbsession.commit()
-                categories = []
-                result = await dbsession.execute(item_stmt)
-                for item in result.scalars():
-                    for category in item.attributes["_categories"]:
-                        categories.append(category.lower())
-                old_counts = len(counts)
-                counts = [
-                    (cat, count)
-                    for cat, count in Counter(categories).most_common()
-                    if count >= 15  # noqa: PLR2004
-                ]
-                counts.sort(key=lambda c: c[1])
-                progress.update(task, advance=old_counts - len(counts))
-        await dbsession.commit()
+            task = progress.add_task("Generating groups", total=len(candidates))
+            while candidates:
+                count, _, _, category = heapq.heappop(candidates)
+                if counts[category] != count:
+                    continue
+                if category not in groups:
+                    groups[category] = Group(value=category, label=category[0].upper() + category[1:], split="basic")
+                    dbsession.add(groups[category])
+                changed = set()
+                for item_id in category_items[category]:
+                    if item_id in assignments:
+                        continue
+                    assignments[item_id] = groups[category]
+                    for item_category in item_categories[item_id]:
+                        counts[item_category] = counts[item_category] - 1
+                        changed.add(item_category)
+                        if counts[item_category] == 14:  # noqa: PLR2004
+                            progress.update(task, advance=1)
+                for item_category in changed:
+                    if counts[item_category] >= 15:  # noqa: PLR2004
+                        heapq.heappush(candidates, candidate(item_category))
+            task = progress.add_task("Assigning items to groups", total=None)
+            await dbsession.flush()
+            if assignments:
+                await dbsession.execute(
+                    update(Item), [{"id": item_id, "group_id": group.id} for item_id, group in assignments.items()]
+                )
+            await dbsession.commit()
+            progress.update(task, total=1, completed=1)
 
 
 @group.command()
@@ -71,45 +100,17 @@ def generate_groups():
     asyncio.run(generate_groups_impl())
 
 
-def fill_vector(group):
-    """Create a full vector from a sparse vector in the database."""
-    return array(group.attributes["lda_vector"])
-    # vec = array([0 for _ in range(0, 300)], dtype=float)
-    # for dim, value in group.attributes["lda_vector"]:
-    #     vec[dim] = value
-    # return vec
-
-
-def split_by_similarity(dbsession, group):
+async def split_by_similarity(dbsession, group):
     """Split the groups by similarity."""
-    vectors = {}
-    sorted_items = []
-    current = group.items[0]
-    vectors[current.id] = fill_vector(current)
-    while len(sorted_items) < len(group.items):
-        next_item = None
-        next_sim = None
-        for item in group.items:
-            if item in sorted_items:
-                continue
-            if item.id not in vectors:
-                vectors[item.id] = fill_vector(item)
-            if not next_item or cosine(vectors[current.id], vectors[item.id]) > next_sim:
-                next_item = item
-                next_sim = cosine(vectors[current.id], vectors[item.id])
-        if next_item:
-            sorted_items.append(next_item)
-    limit = len(group.items) / math.ceil(len(group.items) / 100)
-    new_group = Group(value=group.value, label=group.label, parent=group, split="similar")
-    dbsession.add(new_group)
-    count = 0
-    for item in sorted_items:
-        if count > limit:
-            new_group = Group(value=group.value, label=group.label, parent=group, split="similar")
-            dbsession.add(new_group)
-            count = 0
-        item.group = new_group
-        count = count + 1
+    items = list(group.items)
+    item_ids = [item.id for item in items]
+    vectors = await load_vectors(dbsession, item_ids)
+    order, boundaries = similarity_chain(stack_vectors(vectors, item_ids, dtype=float32), max_chunk_size=100)
+    for chunk in split(order, boundaries):
+        new_group = Group(value=group.value, label=group.label, parent=group, split="similar")
+        dbsession.add(new_group)
+        for idx in chunk:
+            items[idx].group = new_group
 
 
 def split_by_attribute(dbsession, group, attr):
@@ -312,7 +313,7 @@ async def split_large_groups_impl():
                             if split_by_year(dbsession, group):
                                 splitting = True
                             else:
-                                split_by_similarity(dbsession, group)
+                                await split_by_similarity(dbsession, group)
                                 splitting = True
                         elif len(group.items) >= 300:  # noqa: PLR2004
                             if split_by_attribute(dbsession, group, "concepts"):
@@ -326,7 +327,7 @@ async def split_large_groups_impl():
                             elif split_by_year(dbsession, group):
                                 splitting = True
                             else:
-                                split_by_similarity(dbsession, group)
+                                await split_by_similarity(dbsession, group)
                                 splitting = True
                 await dbsession.commit()
         progress.update(task, total=1, completed=1)
@@ -375,14 +376,14 @@ def merge_singular_plural():
 
 async def add_parent_groups_impl():
     """Add any required parent groups."""
-    async with async_sessionmaker() as dbsession:
+    async with async_sessionmaker() as dbsession, aat_client:
         stmt = select(Group).filter(Group.parent_id == None).options(selectinload(Group.parent))  # noqa: E711
         result = await dbsession.execute(stmt)
         stmt = select(func.count(Group.id)).filter(Group.parent_id == None)  # noqa: E711
         result_count = await dbsession.execute(stmt)
         for group in track(result.scalars(), total=result_count.scalar_one(), description="Adding parent groups"):
             if "aat" in settings.data.hierarchy.expansions:
-                categories = apply_aat(group.value, merge=False)
+                categories = await apply_aat(group.value, merge=False)
                 if categories:
                     for category_list in categories:
                         mapped = False
@@ -418,7 +419,7 @@ async def add_parent_groups_impl():
                     if not mapped:
                         if group.value not in ["styles and periods"]:
                             for category in apply_nlp(group.value):
-                                hierarchies = apply_aat(category, merge=False)
+                                hierarchies = await apply_aat(category, merge=False)
                                 groups = []
                                 for hierarchy in hierarchies:
                                     if group.value not in hierarchy:
@@ -1,55 +1,273 @@
 """Image manipulation CLI commands."""
 
+import hashlib
+import json
 import os
 import shutil
-import subprocess
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from time import perf_counter
 
+from PIL import Image, ImageOps, features
+from rich import print as output
 from rich.progress import Progress
 from typer import Typer
 
+from museum_map.cli.util import worker_count
+from museum_map.settings import settings
+
 group = Typer(help="Image commands")
 
+FORMAT_EXTENSIONS = {"jpeg": "jpg", "webp": "webp", "avif": "avif"}
+
+
+class ImageManifest:
+    """Manifest of the loaded source images with their size, modification time, hash, and derivatives in SQLite."""
+
+    def __init__(self, path):
+        """Open the manifest, creating it if it does not exist."""
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS images (source TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+            "mtime INTEGER NOT NULL, hash TEXT NOT NULL, target TEXT NOT NULL, derivatives TEXT NOT NULL)"
+        )
+
+    def entries(self):
+        """Return all entries, keyed by their source path."""
+        return {
+            source: {"size": size, "mtime": mtime, "hash": content_hash, "target": target, "derivatives": derivatives}
+            for source, size, mtime, content_hash, target, derivatives in self._connection.execute(
+                "SELECT source, size, mtime, hash, target, derivatives FROM images"
+            )
+        }
+
+    def update(self, entries):
+        """Add or replace the entries, given as (source, size, mtime, hash, target, derivatives) tuples."""
+        with self._connection:
+            self._connection.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)", entries)
+
+    def remove(self, sources):
+        """Remove the entries for the source paths."""
+        with self._connection:
+            self._connection.executemany("DELETE FROM images WHERE source = ?", [(source,) for source in sources])
+
+    def close(self):
+        """Close the manifest."""
+        self._connection.close()
+
+
+def derivative_size(width, height, size):
+    """Return the dimensions of the image scaled to fit into a square of the given size."""
+    scale = min(size / width, size / height)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+def derivative_path(image_target, derivative):
+    """Return the path of the derivative of the target image."""
+    size, image_format = derivative
+    return f"{image_target[: image_target.rfind('.')]}-{size}.{FORMAT_EXTENSIONS[image_format]}"
+
+
+def file_hash(path):
+    """Calculate the SHA-256 hash of the file's content."""
+    with open(path, "rb") as in_f:
+        return hashlib.file_digest(in_f, "sha256").hexdigest()
+
+
+def place_original(image_source, image_target, link=False):  # noqa: FBT002
+    """Copy the original image into the target or hardlink it, falling back to copying across file systems."""
+    if os.path.lexists(image_target):
+        os.unlink(image_target)
+    # Hardlinked originals share their data with the source files, so editing a source file in place changes them too
+    if link:
+        try:
+            os.link(image_source, image_target)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(image_source, image_target)
+
+
+def save_derivative(image, path, image_format, quality, progressive):
+    """Save the derivative image in the given format."""
+    if image_format == "webp":
+        image.save(path, "WEBP", quality=quality, method=4)
+    elif image_format == "avif":
+        image.save(path, "AVIF", quality=quality)
+    else:
+        image.save(path, "JPEG", quality=quality, progressive=progressive, optimize=True)
+
+
+def convert_image(image_source, image_target, derivatives, quality, progressive, original=True, link=False):  # noqa: FBT002
+    """Place the original image and generate the derivatives from a single decode."""
+    os.makedirs(os.path.dirname(image_target), exist_ok=True)
+    if original:
+        place_original(image_source, image_target, link=link)
+    if not derivatives:
+        return
+    largest = max(size for size, _ in derivatives)
+    with Image.open(image_source) as image:
+        # JPEGs are decoded at the smallest scale that is still at least as large as the largest derivative
+        image.draft("RGB", (largest, largest))
+        decoded = ImageOps.exif_transpose(image)
+        if decoded.mode != "RGB":
+            decoded = decoded.convert("RGB")
+        for size in sorted({size for size, _ in derivatives}):
+            resized = decoded.resize(derivative_size(*decoded.size, size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            for derivative in derivatives:
+                if derivative[0] == size:
+                    save_derivative(
+                        resized, derivative_path(image_target, derivative), derivative[1], quality, progressive
+                    )
+
+
+def sync_image(image_source, image_target, known_hash, missing, verify, derivatives, quality, progressive, link):
+    """Convert the image if its content has changed, otherwise only generate its missing files, returning its hash."""
+    try:
+        content_hash = file_hash(image_source) if verify else known_hash
+        if content_hash != known_hash:
+            convert_image(image_source, image_target, derivatives, quality, progressive, link=link)
+        else:
+            original = not os.path.exists(image_target)
+            convert_image(image_source, image_target, missing, quality, progressive, original=original, link=link)
+        return content_hash
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def remove_files(paths):
+    """Remove the files that exist, returning the number of removed files."""
+    removed = 0
+    for path in paths:
+        if os.path.exists(path):
+            os.unlink(path)
+            removed = removed + 1
+    return removed
+
 
 @group.command()
-def load_images(source, target):
-    """Load and convert images."""
+def load_images(
+    source,
+    target,
+    workers: int = 0,
+    incremental: bool = False,  # noqa: FBT001, FBT002
+    link_originals: bool = False,  # noqa: FBT001, FBT002
+):
+    """Load and convert images, removing orphans if incremental and hardlinking the originals if link-originals."""
+    workers = worker_count(workers)
+    image_settings = settings.images
+    if "avif" in image_settings.formats and not features.check("avif"):
+        output("[red]AVIF derivatives are configured, but Pillow was built without AVIF support[/red]")
+        return
+    derivatives = [(size, image_format) for size in image_settings.sizes for image_format in image_settings.formats]
+    manifest = ImageManifest(image_settings.manifest)
+    recorded_entries = manifest.entries()
+    known = recorded_entries if incremental else {}
     with Progress() as progress:
         task = progress.add_task("Scanning files", total=None)
-        total = 0
-        for _basepath, _, filenames in os.walk(source):
-            for filename in filenames:
-                if filename.endswith(".jpg"):
-                    total = total + 1
-        progress.update(task, total=total, completed=total)
-        task = progress.add_task("Loading images", total=total)
+        jobs = []
+        entries = {}
+        skipped = 0
         for basepath, _, filenames in os.walk(source):
             for filename in filenames:
                 if filename.endswith(".jpg"):
                     image_id = filename[: filename.find(".")]
-                    os.makedirs(os.path.join(target, *image_id), exist_ok=True)
                     image_source = os.path.join(basepath, filename)
+                    key = os.path.relpath(image_source, source).replace(os.sep, "/")
                     image_target = os.path.join(target, *image_id, filename)
-                    shutil.copy(image_source, image_target)
-                    subprocess.run(  # noqa:S603
-                        [  # noqa: S607
-                            "gm",
-                            "convert",
-                            image_source,
-                            "-resize",
-                            "240x240",
-                            image_target.replace(".jpg", "-240.jpg"),
-                        ],
-                        check=True,
-                    )
-                    subprocess.run(  # noqa:S603
-                        [  # noqa: S607
-                            "gm",
-                            "convert",
-                            image_source,
-                            "-resize",
-                            "320x320",
-                            image_target.replace(".jpg", "-320.jpg"),
-                        ],
-                        check=True,
-                    )
-                    progress.update(task, advance=1)
+                    stat = os.stat(image_source)
+                    entries[key] = (image_source, image_target, stat.st_size, stat.st_mtime_ns)
+                    entry = known.get(key)
+                    if entry is None or entry["target"] != image_target:
+                        jobs.append((key, None, derivatives, True))
+                        continue
+                    missing = [
+                        derivative
+                        for derivative in derivatives
+                        if not os.path.exists(derivative_path(image_target, derivative))
+                    ]
+                    if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+                        # The content is only converted again if its hash shows that it has actually changed
+                        jobs.append((key, entry["hash"], missing, True))
+                    elif missing or not os.path.exists(image_target):
+                        jobs.append((key, entry["hash"], missing, False))
+                    else:
+                        skipped = skipped + 1
+            progress.update(task, completed=len(entries))
+        progress.update(task, total=len(entries), completed=len(entries))
+        orphans = []
+        removed = 0
+        updates = []
+        if incremental:
+            task = progress.add_task("Removing orphans and stale derivatives", total=len(known))
+            targets = {image_target for _, image_target, _, _ in entries.values()}
+            for key, entry in known.items():
+                recorded = [tuple(derivative) for derivative in json.loads(entry["derivatives"])]
+                if key in entries and entries[key][1] == entry["target"]:
+                    stale = [derivative for derivative in recorded if derivative not in derivatives]
+                    if stale:
+                        removed = removed + remove_files(derivative_path(entry["target"], d) for d in stale)
+                        # The entry is replaced again if the image is converted, but it is kept if it is skipped
+                        current = [derivative for derivative in recorded if derivative in derivatives]
+                        updates.append(
+                            (key, entry["size"], entry["mtime"], entry["hash"], entry["target"], json.dumps(current))
+                        )
+                else:
+                    orphans.append(key)
+                    # Files that another source image is now loaded into are overwritten rather than removed
+                    if entry["target"] not in targets:
+                        remove_files([entry["target"]])
+                        removed = removed + remove_files(derivative_path(entry["target"], d) for d in recorded)
+                progress.update(task, advance=1)
+            manifest.remove(orphans)
+        else:
+            # All images are converted again, so only the manifest entries of removed source images are left over
+            orphans = [key for key in recorded_entries if key not in entries]
+            manifest.remove(orphans)
+        task = progress.add_task("Loading images", total=len(jobs))
+        start = perf_counter()
+        total_bytes = 0
+        failed = []
+        sync = partial(
+            sync_image,
+            derivatives=derivatives,
+            quality=image_settings.quality,
+            progressive=image_settings.progressive,
+            link=link_originals,
+        )
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                sync,
+                [entries[job[0]][0] for job in jobs],
+                [entries[job[0]][1] for job in jobs],
+                [job[1] for job in jobs],
+                [job[2] for job in jobs],
+                [job[3] for job in jobs],
+                chunksize=16,
+            )
+            for (key, *_), content_hash in zip(jobs, results, strict=True):
+                image_source, image_target, size, mtime = entries[key]
+                if content_hash is None:
+                    failed.append(image_source)
+                else:
+                    total_bytes = total_bytes + size
+                    updates.append((key, size, mtime, content_hash, image_target, json.dumps(derivatives)))
+                progress.update(task, advance=1)
+        manifest.update(updates)
+        manifest.close()
+        elapsed = max(perf_counter() - start, 1e-9)
+    converted = len(jobs) - len(failed)
+    output(
+        f"Converted {converted} images in {elapsed:.1f}s "
+        f"({converted / elapsed:.1f} images/s, {total_bytes / elapsed / 1024 / 1024:.1f} MB/s), "
+        f"{skipped} images were up to date"
+    )
+    if incremental:
+        output(f"Removed {len(orphans)} orphaned images and {removed} orphaned or stale derivatives")
+    elif orphans:
+        output(f"Removed {len(orphans)} manifest entries of images that no longer exist")
+    if failed:
+        output(f"[red]Failed to convert {len(failed)} images[/red]")
+        for image_source in failed[:10]:
+            output(f"[red]  {image_source}[/red]")
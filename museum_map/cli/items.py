@@ -1,18 +1,21 @@
 """Item processing CLI commands."""
 
 import asyncio
-import json
 import os
+from functools import lru_cache
 
-import requests
+import numpy as np
 from bertopic import BERTopic
-from lxml import etree
+from rich import print as output
 from rich.progress import Progress
-from sqlalchemy import func
+from sqlalchemy import bindparam, func
 from sqlalchemy.future import select
 from typer import Typer
 
-from museum_map.models import Item, async_sessionmaker
+from museum_map.cli.aat import client as aat_client
+from museum_map.cli.embeddings import EmbeddingCache, document_hash
+from museum_map.cli.util import MEMO_CACHE_SIZE, changed_items, keyset_batches
+from museum_map.models import Item, async_sessionmaker, encode_vector, update_attribute
 from museum_map.settings import settings
 
 group = Typer(help="Item processing commands")
@@ -31,6 +34,17 @@ def strip_article(text):
 
 def apply_nlp(category):
     """Recursively apply the NLP processing rules."""
+    return list(cached_nlp(category))
+
+
+@lru_cache(maxsize=MEMO_CACHE_SIZE)
+def cached_nlp(category):
+    """Apply the NLP processing rules, memoising the result."""
+    return tuple(nlp_rules(category))
+
+
+def nlp_rules(category):
+    """Apply the NLP processing rules to a single category."""
     if " " in category:
         if " for " in category:
             idx = category.find(" for ")
@@ -112,61 +126,16 @@ def apply_nlp(category):
         return []
 
 
-def apply_aat(category, merge=True):  # noqa: FBT002
+async def apply_aat(category, merge=True):  # noqa: FBT002
     """Expand the category using the AAT."""
-    if os.path.exists("aat.json"):
-        with open("aat.json") as in_f:
-            cache = json.load(in_f)
-    else:
-        cache = {}
-    if category not in cache:
-        cache[category] = []
-        response = requests.get(
-            "http://vocabsservices.getty.edu/AATService.asmx/AATGetTermMatch",
-            params=[("term", f'"{category}"'), ("logop", "and"), ("notes", "")],
-            timeout=300,
-        )
-        if response.status_code == 200:  # noqa: PLR2004
-            subjects = etree.fromstring(response.content).xpath("Subject/Subject_ID/text()")  # noqa: S320
-            hierarchies = []
-            for subject in subjects:
-                response2 = requests.get(
-                    "http://vocabsservices.getty.edu/AATService.asmx/AATGetSubject",
-                    params=[("subjectID", subject)],
-                    timeout=300,
-                )
-                if response.status_code == 200:  # noqa: PLR2004
-                    hierarchy_text = etree.fromstring(response2.content).xpath("Subject/Hierarchy/text()")  # noqa: S320
-                    if hierarchy_text:
-                        hierarchy = []
-                        for entry in [h.strip() for h in hierarchy_text[0].split("|") if "<" not in h]:
-                            entry = entry.lower()  # noqa: PLW2901
-                            if "(" in entry:
-                                entry = entry[: entry.find("(")].strip()  # noqa: PLW2901
-                            if entry.endswith(" facet"):
-                                entry = entry[: entry.find(" facet")].strip()  # noqa: PLW2901
-                            if entry.endswith(" genres"):
-                                entry = entry[: entry.find(" genres")].strip()  # noqa: PLW2901
-                            if entry not in hierarchy:
-                                hierarchy.append(entry)
-                        hierarchies.append(hierarchy)
-            cache[category] = hierarchies
-            for hierarchy in hierarchies:
-                for start in range(0, len(hierarchy)):
-                    if hierarchy[start] not in cache:
-                        if hierarchy[start + 1 :]:
-                            cache[hierarchy[start]] = [hierarchy[start + 1 :]]
-                        else:
-                            cache[hierarchy[start]] = []
-        with open("aat.json", "w") as out_f:
-            json.dump(cache, out_f)
+    hierarchies = await aat_client.lookup(category)
     if merge:
-        if len(cache[category]) > 1:
+        if len(hierarchies) > 1:
             merged = []
             added = True
             while added:
                 added = False
-                for hierarchy in cache[category]:
+                for hierarchy in hierarchies:
                     if hierarchy:
                         item = hierarchy.pop()
                         added = True
@@ -174,89 +143,197 @@ def apply_aat(category, merge=True):  # noqa: FBT002
                             merged.append(item)
             merged.reverse()
             return merged
-        elif len(cache[category]) == 1:
-            return cache[category][0]
+        elif len(hierarchies) == 1:
+            return hierarchies[0]
         return []
     else:
-        return cache[category]
+        return hierarchies
+
+
+class CategoryExpander:
+    """Expands the categories of items, expanding each distinct category only once."""
+
+    def __init__(self, expansions):
+        """Initialise the expander with the list of expansions to apply."""
+        self._expansions = expansions
+        self._nlp = {}
+        self._aat = {}
+        self.distinct = 0
+        self.references = 0
+
+    async def prepare(self, categories):
+        """Expand all distinct categories."""
+        lowered = {category.lower() for category in categories}
+        self.distinct = len(lowered)
+        if "nlp" in self._expansions:
+            for category in lowered:
+                self._nlp[category] = apply_nlp(category)
+        if "aat" in self._expansions:
+            terms = set(lowered)
+            for expanded in self._nlp.values():
+                terms.update(expanded)
+            await aat_client.prefetch(terms)
+            for term in terms:
+                self._aat[term] = await apply_aat(term)
 
+    def expand(self, categories):
+        """Expand a list of categories, using the prepared expansions."""
+        expanded = [c.lower() for c in categories]
+        self.references = self.references + len(expanded)
+        if "nlp" in self._expansions:
+            for category in categories:
+                expanded = expanded + self._nlp[category.lower()]
+        if "aat" in self._expansions:
+            for category in list(expanded):
+                expanded = expanded + self._aat[category]
+        return expanded
 
-async def expand_categories_impl():
-    """Expand the object categories."""
-    async with async_sessionmaker() as dbsession:
-        count = await dbsession.execute(select(func.count(Item.id)))
-        result = await dbsession.execute(select(Item))
+    def statistics(self):
+        """Return a summary of how often the expansions were re-used."""
+        nlp_info = cached_nlp.cache_info()
+        hit_rate = 1 - self.distinct / self.references if self.references else 0
+        return (
+            f"Expanded {self.distinct} distinct categories for {self.references} category references "
+            f"(hit rate {hit_rate:.1%}). NLP memo: {nlp_info.hits} hits, {nlp_info.misses} misses, "
+            f"{nlp_info.currsize} entries"
+        )
+
+
+async def expand_categories_impl(batch_size: int = 1000, start_after: int = 0, changes: str | None = None):
+    """Expand the object categories, only for the added and updated items if a change set is given."""
+    field = settings.data.hierarchy.field
+    stmt = select(Item.id, Item.attributes[field]).filter(Item.deleted.is_(False))
+    count_stmt = select(func.count(Item.id)).filter(Item.id > start_after, Item.deleted.is_(False))
+    if changes is not None:
+        stmt = stmt.filter(changed_items(changes))
+        count_stmt = count_stmt.filter(changed_items(changes))
+    expander = CategoryExpander(settings.data.hierarchy.expansions)
+    async with aat_client:
         with Progress() as progress:
-            task = progress.add_task("Expanding categories", total=count.scalar_one())
-            for item in result.scalars():
-                categories = [c.lower() for c in item.attributes[settings.data.hierarchy.field]]
-                if "nlp" in settings.data.hierarchy.expansions:
-                    for category in item.attributes[settings.data.hierarchy.field]:
-                        categories = categories + apply_nlp(category.lower())
-                if "aat" in settings.data.hierarchy.expansions:
-                    for category in list(categories):
-                        categories = categories + apply_aat(category)
-                item.attributes["_categories"] = categories
-                progress.update(task, advance=1)
-        await dbsession.commit()
+            async with async_sessionmaker() as dbsession:
+                count = (await dbsession.execute(count_stmt)).scalar_one()
+                task = progress.add_task("Collecting distinct categories", total=count)
+                categories = set()
+                async for rows in keyset_batches(dbsession, stmt, Item.id, batch_size, start_after):
+                    for _, values in rows:
+                        categories.update(values)
+                    progress.update(task, advance=len(rows))
+            task = progress.add_task("Expanding distinct categories", total=None)
+            await expander.prepare(categories)
+            progress.update(task, total=1, completed=1)
+            task = progress.add_task("Expanding categories", total=count)
+            update_stmt = update_attribute("_categories")
+            async with async_sessionmaker() as dbsession:
+                async for rows in keyset_batches(dbsession, stmt, Item.id, batch_size, start_after):
+                    params = [{"item_id": item_id, "value": expander.expand(values)} for item_id, values in rows]
+                    await dbsession.execute(update_stmt, params)
+                    await dbsession.commit()
+                    progress.update(
+                        task, advance=len(rows), description=f"Expanding categories (committed up to {rows[-1][0]})"
+                    )
+    output(expander.statistics())
 
 
 @group.command()
-def expand_categories():
-    """Expand the object categories."""
-    asyncio.run(expand_categories_impl())
+def expand_categories(batch_size: int = 1000, start_after: int = 0, changes: str | None = None):
+    """Expand the object categories, only for the added and updated items if a change set is given."""
+    asyncio.run(expand_categories_impl(batch_size, start_after, changes))
 
 
-async def generate_topic_vectors_impl():
-    """Generate topic vectors for all items."""
-    topic_model = BERTopic()
+def topic_document(values):
+    """Build the topic modelling document from the topic field values."""
+    text = []
+    for value in values:
+        if value is not None and value.strip() != "":
+            if value.endswith("."):
+                text.append(value)
+            else:
+                text.append(f"{value}.")
+    return " ".join(text)
+
+
+async def generate_topic_vectors_impl(batch_size: int = 1000, incremental: bool = False):  # noqa: FBT001, FBT002
+    """Generate topic vectors for all items, or only for new and changed items if incremental."""
+    topic_settings = settings.data.topics
+    embedding_cache = EmbeddingCache(topic_settings.embedding_cache, topic_settings.embedding_model)
+    item_ids = []
     documents = []
+    hashes = []
+    changed = []
+    stmt = select(
+        Item.id,
+        Item.attributes["_topic_hash"],
+        Item.topic_vector.is_(None),
+        *[Item.attributes[field] for field in settings.data.topic_fields],
+    ).filter(Item.deleted.is_(False))
     with Progress() as progress:
         async with async_sessionmaker() as dbsession:
-            count = (await dbsession.execute(select(func.count(Item.id)))).scalar_one()
-            result = await dbsession.execute(select(Item))
+            count = (await dbsession.execute(select(func.count(Item.id)).filter(Item.deleted.is_(False)))).scalar_one()
             task = progress.add_task("Loading items", total=count)
-            for item in result.scalars():
-                text = []
-                for field in settings.data.topic_fields:
-                    if field in item.attributes and item.attributes[field].strip() != "":
-                        if item.attributes[field].endswith("."):
-                            text.append(item.attributes[field])
-                        else:
-                            text.append(f"{item.attributes[field]}.")
-                documents.append(" ".join(text))
-                progress.update(task, advance=1)
-        task = progress.add_task("Generating topic model", total=None)
-        topic_model.fit(documents)
-        progress.update(task, total=1, completed=1)
-        topics = topic_model.get_topics()
+            async for rows in keyset_batches(dbsession, stmt, Item.id, batch_size):
+                for item_id, stored_hash, no_vector, *values in rows:
+                    document = topic_document(values)
+                    item_ids.append(item_id)
+                    documents.append(document)
+                    hashes.append(document_hash(document))
+                    changed.append(no_vector or stored_hash != hashes[-1])
+                progress.update(task, advance=len(rows))
+        # Only new and changed items are assigned topics, if there is an existing topic model to assign them from
+        incremental = incremental and os.path.exists(topic_settings.model)
+        if incremental:
+            selected = [idx for idx in range(len(item_ids)) if changed[idx]]
+        else:
+            selected = list(range(len(item_ids)))
+        if not selected:
+            output("All topic vectors are up to date")
+            return
+        selected_hashes = [hashes[idx] for idx in selected]
+        selected_documents = [documents[idx] for idx in selected]
+        missing = embedding_cache.missing(selected_hashes)
+        task = progress.add_task("Embedding new documents", total=len(missing))
+        documents_by_hash = dict(zip(selected_hashes, selected_documents, strict=True))
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start : start + batch_size]
+            embedding_cache.encode(batch, [documents_by_hash[key] for key in batch])
+            progress.update(task, advance=len(batch))
+        embeddings = embedding_cache.get(selected_hashes)
+        if incremental:
+            task = progress.add_task("Assigning topics", total=None)
+            topic_model = BERTopic.load(topic_settings.model)
+            topic_ids, probabilities = topic_model.transform(selected_documents, embeddings=embeddings)
+        else:
+            task = progress.add_task("Generating topic model", total=None)
+            topic_model = BERTopic()
+            topic_ids, probabilities = topic_model.fit_transform(selected_documents, embeddings=embeddings)
+            topic_model.save(topic_settings.model, serialization="pickle", save_embedding_model=False)
+        topic_count = len(topic_model.get_topics())
         progress.update(task, total=1, completed=1)
+        task = progress.add_task("Storing topic vectors", total=len(selected))
+        update_stmt = update_attribute("_topic_hash").values(topic_vector=bindparam("vector"))
         async with async_sessionmaker() as dbsession:
-            count = (await dbsession.execute(select(func.count(Item.id)))).scalar_one()
-            result = await dbsession.execute(select(Item))
-            task = progress.add_task("Calculating topic vectors", total=count)
-            for item in result.scalars():
-                text = []
-                for field in settings.data.topic_fields:
-                    if field in item.attributes and item.attributes[field].strip() != "":
-                        if item.attributes[field].endswith("."):
-                            text.append(item.attributes[field])
-                        else:
-                            text.append(f"{item.attributes[field]}.")
-                topic_ids, probabilities = topic_model.transform([" ".join(text)])
-                topic_vector = [0.0 for _ in range(0, len(topics))]
-                for topic_id, probability in zip(topic_ids, probabilities, strict=True):
-                    if topic_id >= 0 and topic_id < len(topic_vector):
-                        topic_vector[int(topic_id)] = float(probability)
-                item.attributes["lda_vector"] = topic_vector
-                progress.update(task, advance=1)
-            await dbsession.commit()
+            for start in range(0, len(selected), batch_size):
+                params = []
+                for offset in range(start, min(start + batch_size, len(selected))):
+                    topic_vector = np.zeros(topic_count, dtype=np.float32)
+                    if topic_ids[offset] >= 0 and topic_ids[offset] < topic_count:
+                        topic_vector[int(topic_ids[offset])] = probabilities[offset]
+                    params.append(
+                        {
+                            "item_id": item_ids[selected[offset]],
+                            "value": hashes[selected[offset]],
+                            "vector": encode_vector(topic_vector),
+                        }
+                    )
+                await dbsession.execute(update_stmt, params)
+                await dbsession.commit()
+                progress.update(task, advance=len(params))
+    output(f"Stored topic vectors for {len(selected)} of {len(item_ids)} items, embedding {len(missing)} new documents")
 
 
 @group.command()
-def generate_topic_vectors():
-    """Generate topic vectors for all items."""
-    asyncio.run(generate_topic_vectors_impl())
+def generate_topic_vectors(batch_size: int = 1000, incremental: bool = False):  # noqa: FBT001, FBT002
+    """Generate topic vectors for all items, or only for new and changed items if incremental."""
+    asyncio.run(generate_topic_vectors_impl(batch_size, incremental))
 
 
 async def pipeline_impl():
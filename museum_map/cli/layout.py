@@ -3,18 +3,19 @@
 import asyncio
 import math
 from copy import deepcopy
+from functools import lru_cache
 from random import choice
 
 from inflection import pluralize
 from rich.progress import Progress, track
-from scipy.spatial.distance import cosine
 from sqlalchemy import delete, func
 from sqlalchemy.future import select
 from sqlalchemy.orm import selectinload
 from typer import Typer
 
-from museum_map.cli.groups import fill_vector
-from museum_map.models import Floor, FloorTopic, Group, Item, Room, async_sessionmaker
+from museum_map.cli.similarity import similarity_chain, stack_vectors
+from museum_map.cli.util import MEMO_CACHE_SIZE
+from museum_map.models import Floor, FloorTopic, Group, Item, Room, async_sessionmaker, load_vectors
 from museum_map.settings import settings
 
 group = Typer(help="Layout commands")
@@ -51,6 +52,7 @@ async def get_assignable_groups(dbsession, assigned):
     return groups
 
 
+@lru_cache(maxsize=MEMO_CACHE_SIZE)
 def pluralize_label(label):
     """Pluralise the label."""
     if " " in label:
@@ -232,24 +234,10 @@ async def order_items_impl():
         stmt_count = select(func.count(Room.id))
         result_count = await dbsession.execute(stmt_count)
         for room in track(result.scalars(), total=result_count.scalar_one(), description="Ordering items in rooms"):
-            vectors = {}
-            sorted_items = []
-            current = room.items[0]
-            vectors[current.id] = fill_vector(current)
-            while len(sorted_items) < len(room.items):
-                next_item = None
-                next_sim = None
-                for item in room.items:
-                    if item in sorted_items:
-                        continue
-                    if item.id not in vectors:
-                        vectors[item.id] = fill_vector(item)
-                    if not next_item or cosine(vectors[current.id], vectors[item.id]) > next_sim:
-                        next_item = item
-                        next_sim = cosine(vectors[current.id], vectors[item.id])
-                if next_item:
-                    sorted_items.append(next_item)
-            for idx, item in enumerate(sorted_items):
+            item_ids = [item.id for item in room.items]
+            order, _ = similarity_chain(stack_vectors(await load_vectors(dbsession, item_ids), item_ids))
+            for idx, item_idx in enumerate(order):
+                item = room.items[item_idx]
                 item.sequence = idx
                 dbsession.add(item)
         await dbsession.commit()
@@ -0,0 +1,185 @@
+"""Tracking log storage CLI commands."""
+
+import asyncio
+import gzip
+import json
+import os
+import re
+from datetime import UTC, datetime
+
+from rich import print as output
+from rich.progress import Progress
+from sqlalchemy import Float, Integer, Unicode, text
+from sqlalchemy.dialects.postgresql import JSONB
+from typer import Typer
+
+from museum_map.models import LogEntry, async_engine
+from museum_map.settings import settings
+
+group = Typer(help="Tracking log commands")
+
+PARTITION_PATTERN = re.compile(r"^log_entries_(\d{4})_(\d{2})$")
+
+
+def next_month(year, month):
+    """Return the year and month following the given month."""
+    return year + month // 12, month % 12 + 1
+
+
+def month_timestamp(year, month):
+    """Return the UTC timestamp at the start of the month."""
+    return datetime(year, month, 1, tzinfo=UTC).timestamp()
+
+
+def partition_name(year, month):
+    """Return the name of the partition for the month."""
+    return f"log_entries_{year:04d}_{month:02d}"
+
+
+async def ensure_partition(conn, year, month):
+    """Create the partition for the month, moving its entries out of the default partition."""
+    name = partition_name(year, month)
+    if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+        return False
+    bounds = {"start": month_timestamp(year, month), "end": month_timestamp(*next_month(year, month))}
+    # Entries for the month that are in the default partition would block attaching the new partition
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE log_entries INCLUDING DEFAULTS)"))
+    await conn.execute(
+        text(
+            f"INSERT INTO {name} SELECT * FROM log_entries_default WHERE timestamp >= :start AND timestamp < :end"  # noqa: S608
+        ),
+        bounds,
+    )
+    await conn.execute(text("DELETE FROM log_entries_default WHERE timestamp >= :start AND timestamp < :end"), bounds)
+    await conn.execute(
+        text(
+            f"ALTER TABLE log_entries ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ({bounds['start']!r}) TO ({bounds['end']!r})"
+        )
+    )
+    return True
+
+
+async def ensure_partitions(conn, ahead):
+    """Create the partitions for the current and the following months and for all months in the default partition."""
+    now = datetime.now(tz=UTC)
+    months = [(now.year, now.month)]
+    for _ in range(ahead):
+        months.append(next_month(*months[-1]))
+    result = await conn.execute(
+        text(
+            "SELECT DISTINCT CAST(EXTRACT(YEAR FROM to_timestamp(timestamp) AT TIME ZONE 'UTC') AS INTEGER), "
+            "CAST(EXTRACT(MONTH FROM to_timestamp(timestamp) AT TIME ZONE 'UTC') AS INTEGER) FROM log_entries_default"
+        )
+    )
+    months.extend(tuple(row) for row in result)
+    created = []
+    for year, month in sorted(set(months)):
+        if await ensure_partition(conn, year, month):
+            created.append(partition_name(year, month))
+    return created
+
+
+async def partitions_impl(ahead: int = settings.tracking.partitions_ahead):
+    """Create the monthly tracking log partitions."""
+    async with async_engine.begin() as conn:
+        created = await ensure_partitions(conn, ahead)
+    if created:
+        output(f"Created the partitions {', '.join(created)}")
+    else:
+        output("All partitions already exist")
+
+
+@group.command()
+def partitions(ahead: int = settings.tracking.partitions_ahead):
+    """Create the monthly tracking log partitions."""
+    asyncio.run(partitions_impl(ahead))
+
+
+async def archive_impl(retention: int = settings.tracking.retention_months):
+    """Export all monthly partitions older than the retention period to compressed files and drop them."""
+    now = datetime.now(tz=UTC)
+    cutoff = now.year * 12 + now.month - 1 - retention
+    async with async_engine.connect() as conn:
+        result = await conn.execute(
+            text(
+                "SELECT c.relname FROM pg_catalog.pg_inherits i JOIN pg_catalog.pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'log_entries'::regclass"
+            )
+        )
+        expired = []
+        for name in result.scalars():
+            match = PARTITION_PATTERN.match(name)
+            if match and int(match.group(1)) * 12 + int(match.group(2)) - 1 < cutoff:
+                expired.append(name)
+    expired.sort()
+    os.makedirs(settings.tracking.archive_path, exist_ok=True)
+    with Progress() as progress:
+        task = progress.add_task("Archiving partitions", total=len(expired))
+        for name in expired:
+            target = os.path.join(settings.tracking.archive_path, f"{name}.jsonl.gz")
+            query = text(
+                f"SELECT id, user_id, action, timestamp, params FROM {name} ORDER BY timestamp, id"  # noqa: S608
+            ).columns(id=Integer, user_id=Integer, action=Unicode, timestamp=Float, params=JSONB)
+            async with async_engine.connect() as conn:
+                with gzip.open(f"{target}.tmp", "wt", encoding="utf-8") as out_f:
+                    async for row in await conn.stream(query):
+                        out_f.write(json.dumps(row._asdict()))
+                        out_f.write("\n")
+            os.replace(f"{target}.tmp", target)
+            async with async_engine.begin() as conn:
+                await conn.execute(text(f"ALTER TABLE log_entries DETACH PARTITION {name}"))
+                await conn.execute(text(f"DROP TABLE {name}"))
+            progress.update(task, advance=1)
+    output(f"Archived {len(expired)} partitions to {settings.tracking.archive_path}")
+
+
+@group.command()
+def archive(retention: int = settings.tracking.retention_months):
+    """Export all monthly partitions older than the retention period (in months) to compressed files and drop them."""
+    asyncio.run(archive_impl(retention))
+
+
+async def migrate_impl():
+    """Convert an existing, unpartitioned tracking log table into the partitioned table."""
+    async with async_engine.begin() as conn:
+        kind = (
+            await conn.execute(text("SELECT relkind FROM pg_catalog.pg_class WHERE oid = to_regclass('log_entries')"))
+        ).scalar()
+        if kind == "p":
+            output("The tracking log table is already partitioned")
+            return
+        if kind is not None:
+            # The existing table's constraint, index, and sequence names would clash with the new table's ones
+            await conn.execute(text("ALTER TABLE log_entries RENAME TO log_entries_unpartitioned"))
+            await conn.execute(
+                text(
+                    "ALTER TABLE log_entries_unpartitioned "
+                    "RENAME CONSTRAINT pk_log_entries TO pk_log_entries_unpartitioned"
+                )
+            )
+            await conn.execute(
+                text("ALTER INDEX IF EXISTS ix_log_entries_user_id RENAME TO ix_log_entries_unpartitioned_user_id")
+            )
+            await conn.execute(text("ALTER SEQUENCE log_entries_id_seq RENAME TO log_entries_unpartitioned_id_seq"))
+        await conn.run_sync(LogEntry.__table__.create)
+        if kind is not None:
+            await conn.execute(
+                text(
+                    "INSERT INTO log_entries (id, user_id, action, timestamp, params) "
+                    "SELECT id, user_id, action, COALESCE(timestamp, 0), CAST(params AS JSONB) "
+                    "FROM log_entries_unpartitioned"
+                )
+            )
+            await conn.execute(
+                text("SELECT setval('log_entries_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM log_entries")
+            )
+            await conn.execute(text("DROP TABLE log_entries_unpartitioned"))
+        created = await ensure_partitions(conn, settings.tracking.partitions_ahead)
+    output(f"Migrated the tracking log table, creating the partitions {', '.join(created)}")
+
+
+@group.command()
+def migrate():
+    """Convert an existing, unpartitioned tracking log table into the partitioned table."""
+    asyncio.run(migrate_impl())
@@ -0,0 +1,101 @@
+"""Publishing CLI commands."""
+
+import asyncio
+from datetime import UTC, datetime
+
+from rich import print as output
+from rich.progress import Progress
+from sqlalchemy import func
+from sqlalchemy.future import select
+from typer import Typer
+
+from museum_map.cli.util import keyset_batches
+from museum_map.models import (
+    Floor,
+    FloorModel,
+    FloorTopicModel,
+    Item,
+    ItemModel,
+    Room,
+    RoomModel,
+    async_sessionmaker,
+    floor_payloads,
+    floor_topic_payloads,
+    item_payload,
+    item_payloads,
+    room_payloads,
+)
+from museum_map.settings import settings
+from museum_map.snapshot import write_snapshot
+
+group = Typer(help="Publishing commands")
+
+
+async def snapshot_impl(batch_size: int = 1000):
+    """Publish the floors, rooms, floor topics, and items as a new read-model snapshot."""
+    async with async_sessionmaker() as dbsession:
+        unordered_stmt = select(func.count(Item.id)).filter(Item.room_id.is_not(None), Item.sequence.is_(None))
+        unordered = (await dbsession.execute(unordered_stmt)).scalar_one()
+    if unordered > 0:
+        output(f"[red]{unordered} items in rooms have not been ordered. Run layout order-items before publishing[/red]")
+        return
+    version = datetime.now(tz=UTC).strftime("%Y%m%dT%H%M%S%fZ")
+    with Progress() as progress:
+        async with async_sessionmaker() as dbsession:
+            task = progress.add_task("Publishing floors and rooms", total=None)
+            query = floor_payloads().order_by(Floor.level)
+            floors = [
+                FloorModel.model_validate(row._asdict()).model_dump(mode="json")
+                for row in await dbsession.execute(query)
+            ]
+            floor_topics = [
+                FloorTopicModel.model_validate(row._asdict()).model_dump(mode="json")
+                for row in await dbsession.execute(floor_topic_payloads())
+            ]
+            query = room_payloads().order_by(Room.floor_id, Room.number)
+            rooms = [
+                RoomModel.model_validate(row._asdict()).model_dump(mode="json")
+                for row in await dbsession.execute(query)
+            ]
+            progress.update(task, total=1, completed=1)
+            count = (
+                await dbsession.execute(select(func.count(Item.id)).filter(Item.room_id.is_not(None)))
+            ).scalar_one()
+            task = progress.add_task("Publishing items", total=count)
+            # Items are published with the public attributes, as returned by the API without a fields parameter
+            attributes = settings.app.item.public_attributes()
+            query = item_payloads(attributes).filter(Item.room_id.is_not(None))
+            items = []
+            async for rows in keyset_batches(dbsession, query, Item.id, batch_size):
+                items.extend(
+                    ItemModel.model_validate(item_payload(row, attributes)).model_dump(mode="json") for row in rows
+                )
+                progress.update(task, advance=len(rows))
+        # Items are published in room order, so that the per-room item lists are in sequence
+        items.sort(key=lambda item: (item["room"], item["sequence"]))
+        task = progress.add_task("Writing the snapshot", total=None)
+        write_snapshot(
+            settings.publish.path,
+            version,
+            {"floors": floors, "floor_topics": floor_topics, "rooms": rooms, "items": items},
+            keep=settings.publish.keep,
+        )
+        progress.update(task, total=1, completed=1)
+    output(f"Published snapshot version {version}")
+
+
+@group.command()
+def snapshot(batch_size: int = 1000):
+    """Publish the floors, rooms, floor topics, and items as a new read-model snapshot."""
+    asyncio.run(snapshot_impl(batch_size))
+
+
+async def pipeline_impl():
+    """Run the publishing pipeline."""
+    await snapshot_impl()
+
+
+@group.command()
+def pipeline():
+    """Run the publishing pipeline."""
+    asyncio.run(pipeline_impl())
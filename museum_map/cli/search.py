@@ -2,18 +2,21 @@
 
 import asyncio
 import logging
+from datetime import UTC, datetime
 
 from meilisearch_python_sdk import AsyncClient
 from meilisearch_python_sdk.models.settings import Faceting
 from meilisearch_python_sdk.models.task import TaskInfo
+from rich import print as output
 from rich.progress import Progress, TaskID
-from sqlalchemy import func
+from sqlalchemy import ARRAY, Integer, any_, bindparam, func
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
 from typer import Typer
 
 # from museum_map.cli.util import ClickIndeterminate
-from museum_map.models import Room, async_sessionmaker
+from museum_map.cli.util import keyset_batches, read_changes
+from museum_map.models import Item, Room, async_sessionmaker
+from museum_map.search import write_embedded_index
 from museum_map.settings import settings
 
 group = Typer(help="Search commands")
@@ -35,52 +38,129 @@ async def wait_for_tasks_completion(
         progress.update(progress_task, completed=completed, total=len(tasks))
 
 
-async def index_impl():
-    """Index the full collection."""
-    with Progress() as progress:
+async def generate_documents(progress: Progress, condition=None) -> list[dict]:
+    """Generate the search documents for all items in rooms, optionally restricted by the condition."""
+    stmt = select(Item.id, Item.room_id, Room.floor_id, Item.attributes).join(Room, Item.room_id == Room.id)
+    count_stmt = select(func.count(Item.id)).join(Room, Item.room_id == Room.id)
+    if condition is not None:
+        stmt = stmt.filter(condition)
+        count_stmt = count_stmt.filter(condition)
+    docs = []
+    async with async_sessionmaker() as dbsession:
+        count = (await dbsession.execute(count_stmt)).scalar_one()
+        progress_task = progress.add_task("Generating item documents", total=count)
+        async for rows in keyset_batches(dbsession, stmt, Item.id, 1000):
+            for item_id, room_id, floor_id, attributes in rows:
+                doc = {
+                    "mmap_id": item_id,
+                    "mmap_room": room_id,
+                    "mmap_floor": floor_id,
+                }
+                doc.update(attributes)
+                docs.append(doc)
+            progress.update(progress_task, advance=len(rows))
+    return docs
+
+
+async def meilisearch_index(docs: list[dict], progress: Progress):
+    """Replace the Meilisearch index with the documents."""
+    async with AsyncClient(str(settings.search.url), settings.search.key) as client:
+        try:
+            index = await client.get_index("items")
+            task = await index.delete()
+            progress_task = progress.add_task("Removing existing indexes", total=None)
+            await wait_for_tasks_completion(client, [task], progress, progress_task)
+        except Exception as e:
+            logger.error(e)
+        items_idx = await client.create_index("items", primary_key="mmap_id")
+        progress_task = progress.add_task("Waiting for indexing to complete", total=None)
+        await wait_for_tasks_completion(client, await items_idx.add_documents_in_batches(docs), progress, progress_task)
+        progress.update(progress_task, total=1, completed=1)
+        progress_task = progress.add_task("Updating filterable attributes", total=None)
+        task = await items_idx.update_filterable_attributes(["mmap_room", "mmap_floor"])
+        await wait_for_tasks_completion(client, [task], progress, progress_task)
+        progress_task = progress.add_task("Updating faceting settings", total=None)
+        task = await items_idx.update_faceting(Faceting(max_values_per_facet=1000))
+        await wait_for_tasks_completion(client, [task], progress, progress_task)
+
+
+async def indexed_placements(items_idx, batch_size: int = 10000) -> dict[int, tuple[int, int]]:
+    """Fetch the room and floor of every document in the Meilisearch index."""
+    placements = {}
+    offset = 0
+    while True:
+        result = await items_idx.get_documents(
+            offset=offset, limit=batch_size, fields=["mmap_id", "mmap_room", "mmap_floor"]
+        )
+        for doc in result.results:
+            placements[int(doc["mmap_id"])] = (doc["mmap_room"], doc["mmap_floor"])
+        offset = offset + len(result.results)
+        if not result.results or offset >= result.total:
+            return placements
+
+
+async def update_meilisearch_index(changes: str, progress: Progress):
+    """Update the existing Meilisearch index with the changed items and the items whose room or floor changed."""
+    change_set = read_changes(changes)
+    async with AsyncClient(str(settings.search.url), settings.search.key) as client:
+        items_idx = await client.get_index("items")
+        progress_task = progress.add_task("Comparing item placements", total=None)
+        indexed = await indexed_placements(items_idx)
         async with async_sessionmaker() as dbsession:
-            async with AsyncClient(str(settings.search.url), settings.search.key) as client:
-                try:
-                    index = await client.get_index("items")
-                    task = await index.delete()
-                    progress_task = progress.add_task("Removing existing indexes", total=None)
-                    await wait_for_tasks_completion(client, [task], progress, progress_task)
-                except Exception as e:
-                    logger.error(e)
-                items_idx = await client.create_index("items", primary_key="mmap_id")
-                stmt = select(Room).options(selectinload(Room.items))
-                result = await dbsession.execute(stmt)
-                stmt_count = select(func.count(Room.id))
-                result_count = await dbsession.execute(stmt_count)
-                docs = []
-                progress_task = progress.add_task("Generating room documents", total=result_count.scalar_one())
-                for room in result.scalars():
-                    for item in room.items:
-                        doc = {
-                            "mmap_id": item.id,
-                            "mmap_room": room.id,
-                            "mmap_floor": room.floor_id,
-                        }
-                        doc.update(item.attributes)
-                        docs.append(doc)
-                    progress.update(progress_task, advance=1)
-                progress_task = progress.add_task("Waiting for indexing to complete", total=None)
-                await wait_for_tasks_completion(
-                    client, await items_idx.add_documents_in_batches(docs), progress, progress_task
+            stmt = select(Item.id, Item.room_id, Room.floor_id).join(Room, Item.room_id == Room.id)
+            placed = {item_id: (room_id, floor_id) for item_id, room_id, floor_id in await dbsession.execute(stmt)}
+        progress.update(progress_task, total=1, completed=1)
+        # Items are only indexed once placed in a room, so the items placed or moved since the last index are added too
+        changed = set(change_set["added"] + change_set["updated"])
+        unplaced = changed - set(placed)
+        changed = {
+            item_id for item_id, placement in placed.items() if item_id in changed or indexed.get(item_id) != placement
+        }
+        removed = set(indexed) - set(placed)
+        docs = await generate_documents(
+            progress, Item.id == any_(bindparam("indexed_ids", sorted(changed), type_=ARRAY(Integer)))
+        )
+        tasks = []
+        if docs:
+            tasks.extend(await items_idx.add_documents_in_batches(docs))
+        if removed:
+            tasks.append(await items_idx.delete_documents([str(item_id) for item_id in sorted(removed)]))
+        progress_task = progress.add_task("Waiting for indexing to complete", total=None)
+        await wait_for_tasks_completion(client, tasks, progress, progress_task)
+        progress.update(progress_task, total=1, completed=1)
+    output(f"Indexed {len(docs)} and removed {len(removed)} items")
+    if unplaced:
+        output(
+            f"[yellow]{len(unplaced)} changed items are not placed in a room and were not indexed. "
+            "They are indexed by the next search index once the layout has placed them[/yellow]"
+        )
+
+
+async def index_impl(changes: str | None = None):
+    """Index the full collection, or only the changed and newly placed items in Meilisearch if a change set is given."""
+    with Progress() as progress:
+        if settings.search.backend == "embedded":
+            # The embedded index is always rebuilt in full, which is fast enough not to need incremental updates
+            if changes is not None:
+                output(
+                    "[yellow]The embedded search index is always rebuilt in full, the change set is ignored[/yellow]"
                 )
-                progress.update(progress_task, total=1, completed=1)
-                progress_task = progress.add_task("Updating filterable attributes", total=None)
-                task = await items_idx.update_filterable_attributes(["mmap_room", "mmap_floor"])
-                await wait_for_tasks_completion(client, [task], progress, progress_task)
-                progress_task = progress.add_task("Updating faceting settings", total=None)
-                task = await items_idx.update_faceting(Faceting(max_values_per_facet=1000))
-                await wait_for_tasks_completion(client, [task], progress, progress_task)
+            docs = await generate_documents(progress)
+            progress_task = progress.add_task("Writing the embedded index", total=None)
+            version = datetime.now(tz=UTC).strftime("%Y%m%dT%H%M%S%fZ")
+            await asyncio.to_thread(write_embedded_index, settings.search.path, version, docs, settings.search.keep)
+            progress.update(progress_task, total=1, completed=1)
+        elif changes is not None:
+            await update_meilisearch_index(changes, progress)
+        else:
+            docs = await generate_documents(progress)
+            await meilisearch_index(docs, progress)
 
 
 @group.command()
-def index():
-    """Index the data."""
-    asyncio.run(index_impl())
+def index(changes: str | None = None):
+    """Index the data, or only the changed and newly placed items in the Meilisearch index if a change set is given."""
+    asyncio.run(index_impl(changes))
 
 
 async def pipeline_impl():
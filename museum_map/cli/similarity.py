@@ -0,0 +1,57 @@
+"""Vectorised similarity ordering for items."""
+
+import math
+
+import numpy as np
+
+
+def stack_vectors(vectors, item_ids, dtype=np.float64):
+    """Stack the topic vectors of the items into a single matrix."""
+    return np.array([vectors[item_id] for item_id in item_ids], dtype=dtype)
+
+
+def anchor_distances(matrix):
+    """Calculate the cosine distance between every row of the matrix and its first row."""
+    products = matrix @ matrix[0]
+    squared_norms = np.einsum("ij,ij->i", matrix, matrix)
+    # Use the same formula and clipping as scipy's cosine, so that ties between (near-)identical vectors resolve
+    # identically. Rows with a zero norm have an undefined (NaN) distance.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.clip(1.0 - products / np.sqrt(squared_norms[0] * squared_norms), 0.0, 2.0)
+
+
+def chunk_boundaries(count, max_size):
+    """Calculate the boundaries for splitting a sequence into evenly sized chunks of roughly at most max_size."""
+    limit = count / math.ceil(count / max_size)
+    return np.arange(math.floor(limit) + 1, count, math.floor(limit) + 1)
+
+
+def similarity_chain(matrix, max_chunk_size=None):
+    """Determine the greedy similarity chain order of the matrix rows and optionally the boundaries of its chunks."""
+    count = matrix.shape[0]
+    if count == 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    distances = anchor_distances(matrix)
+    undefined = np.isnan(distances)
+    defined = np.flatnonzero(~undefined)
+    ranked = defined[np.argsort(-distances[defined], kind="stable")]
+    visited = np.zeros(count, dtype=bool)
+    order = np.empty(count, dtype=np.intp)
+    cursor = 0
+    rank = 0
+    # The chain always compares against the first row. If the first unvisited row has an undefined distance, it is
+    # picked next, otherwise the unvisited row with the largest distance is picked, with ties going to the earlier row.
+    for step in range(count):
+        while visited[cursor]:
+            cursor = cursor + 1
+        if undefined[cursor]:
+            selected = cursor
+        else:
+            while visited[ranked[rank]]:
+                rank = rank + 1
+            selected = ranked[rank]
+        visited[selected] = True
+        order[step] = selected
+    if max_chunk_size is None:
+        return order, np.empty(0, dtype=np.intp)
+    return order, chunk_boundaries(count, max_chunk_size)
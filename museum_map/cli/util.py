@@ -1,9 +1,16 @@
 """Utility functionality for the cli."""
 
+import json
+import os
 from threading import Thread
 from time import sleep
 
 import click
+from sqlalchemy import ARRAY, Integer, any_, bindparam
+
+from museum_map.models import Item
+
+MEMO_CACHE_SIZE = 2**16
 
 
 class ClickIndeterminate(Thread):
@@ -30,3 +37,31 @@ class ClickIndeterminate(Thread):
         """Stop the animation sequence."""
         self._active = False
         click.echo("\b\u2713")
+
+
+async def keyset_batches(dbsession, stmt, id_column, batch_size, start_after=0):
+    """Iterate over the rows of the statement in batches, paginating by the id column."""
+    last_id = start_after
+    while True:
+        rows = (await dbsession.execute(stmt.filter(id_column > last_id).order_by(id_column).limit(batch_size))).all()
+        if not rows:
+            break
+        yield rows
+        last_id = rows[-1][0]
+
+
+def worker_count(workers):
+    """Return the number of worker processes to use, which is one per CPU if workers is 0."""
+    return workers or os.cpu_count() or 1
+
+
+def read_changes(path):
+    """Read the change set of added, updated, deleted, and unplaced item ids written by db load."""
+    with open(path) as in_f:
+        return json.load(in_f)
+
+
+def changed_items(path):
+    """Return a filter for the items that were added or updated in the change set."""
+    changes = read_changes(path)
+    return Item.id == any_(bindparam("changed_ids", changes["added"] + changes["updated"], type_=ARRAY(Integer)))
@@ -1,21 +1,104 @@
 """Database models."""
 
+from sqlalchemy import exc
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from museum_map.models.base import Base  # noqa
-from museum_map.models.floor import Floor, FloorModel, FloorTopic, FloorTopicModel  # noqa
+from museum_map.models.data_version import DataVersion, ensure_data_version  # noqa
+from museum_map.models.floor import (  # noqa
+    Floor,
+    FloorModel,
+    FloorTopic,
+    FloorTopicModel,
+    floor_payloads,
+    floor_topic_payloads,
+)
 from museum_map.models.group import Group  # noqa
-from museum_map.models.item import Item, ItemModel  # noqa
+from museum_map.models.item import (  # noqa
+    Item,
+    ItemModel,
+    decode_vector,
+    encode_vector,
+    item_payload,
+    item_payloads,
+    load_vectors,
+    update_attribute,
+)
 from museum_map.models.log_entry import LogEntry  # noqa
-from museum_map.models.room import Room, RoomModel  # noqa
+from museum_map.models.room import Room, RoomModel, room_payloads  # noqa
 from museum_map.models.user import User, UserModel  # noqa
 from museum_map.settings import settings
 
-async_engine = create_async_engine(settings.db.dsn)
+
+class MonitoredPool(AsyncAdaptedQueuePool):
+    """Connection pool that counts the connection requests that are waiting and that timed out."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialise the pool and its counters."""
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.timeouts = 0
+
+    def connect(self):
+        """Check out a connection, counting the request while it waits because the pool is at its limit."""
+        # Without an idle connection and with the overflow used up, the request waits for a connection to be returned
+        blocked = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        if blocked:
+            self.waiting = self.waiting + 1
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.timeouts = self.timeouts + 1
+            raise
+        finally:
+            if blocked:
+                self.waiting = self.waiting - 1
+
+    def recreate(self):
+        """Recreate the pool, keeping the counters."""
+        pool = super().recreate()
+        pool.timeouts = self.timeouts
+        return pool
+
+
+def create_engine(pool_settings):
+    """Create a database engine with its own connection pool."""
+    return create_async_engine(
+        settings.db.dsn,
+        poolclass=MonitoredPool,
+        pool_size=pool_settings.size,
+        max_overflow=pool_settings.max_overflow,
+        pool_timeout=pool_settings.timeout,
+        pool_recycle=pool_settings.recycle,
+        pool_pre_ping=pool_settings.pre_ping,
+        query_cache_size=settings.db.query_cache_size,
+        connect_args={"prepared_statement_cache_size": settings.db.statement_cache_size},
+    )
+
+
+def pool_statistics(engine):
+    """Return the connection pool statistics for the engine."""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "waiting": pool.waiting,
+        "timeouts": pool.timeouts,
+    }
+
+
+async_engine = create_engine(settings.db.pool)
 async_sessionmaker = sessionmaker(
     bind=async_engine, expire_on_commit=False, autoflush=False, autocommit=False, class_=AsyncSession
 )
+# Tracking writes use their own pool, so that they never compete with the read API for connections
+tracking_engine = create_engine(settings.db.tracking_pool)
+tracking_sessionmaker = sessionmaker(
+    bind=tracking_engine, expire_on_commit=False, autoflush=False, autocommit=False, class_=AsyncSession
+)
 
 
 async def db_session() -> None:
@@ -25,3 +108,12 @@ async def db_session() -> None:
         yield dbsession
     finally:
         await dbsession.close()
+
+
+async def tracking_session() -> None:
+    """Generate a new dbsession for the tracking writes."""
+    dbsession = tracking_sessionmaker()
+    try:
+        yield dbsession
+    finally:
+        await dbsession.close()
@@ -0,0 +1,43 @@
+"""Models for the version of the collection data."""
+
+from sqlalchemy import BigInteger, Column, Float, Integer, text
+
+from museum_map.models.base import Base
+
+VERSIONED_TABLES = ("items", "groups", "rooms", "floors", "floor_topics", "floors_items")
+
+
+class DataVersion(Base):
+    """Database model holding the single counter that changes whenever the collection data is written."""
+
+    __tablename__ = "data_versions"
+
+    id = Column(Integer, primary_key=True)
+    created = Column(Float, nullable=False)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+async def ensure_data_version(conn):
+    """Create the version counter and the triggers that increase it, if they do not exist yet."""
+    # The counter is increased by a statement-level trigger on every table that the read-only API serves data from
+    await conn.execute(
+        text(
+            "INSERT INTO data_versions (id, created, version) VALUES (1, EXTRACT(EPOCH FROM now()), 0) "
+            "ON CONFLICT (id) DO NOTHING"
+        )
+    )
+    await conn.execute(
+        text(
+            "CREATE OR REPLACE FUNCTION increase_data_version() RETURNS TRIGGER AS $$ "
+            "BEGIN UPDATE data_versions SET version = version + 1 WHERE id = 1; RETURN NULL; END "
+            "$$ LANGUAGE plpgsql"
+        )
+    )
+    for table in VERSIONED_TABLES:
+        await conn.execute(text(f"DROP TRIGGER IF EXISTS increase_data_version ON {table}"))
+        await conn.execute(
+            text(
+                f"CREATE TRIGGER increase_data_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table} "
+                "FOR EACH STATEMENT EXECUTE FUNCTION increase_data_version()"
+            )
+        )
@@ -1,10 +1,12 @@
 """Data model for the floors and floor-topics."""
 
 from pydantic import BaseModel, ConfigDict, field_validator
-from sqlalchemy import Column, ForeignKey, Index, Integer, Table, Unicode
+from sqlalchemy import Column, ForeignKey, Index, Integer, Table, Unicode, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import relationship
 
 from museum_map.models.base import Base
+from museum_map.models.room import Room
 
 floors_items = Table(
     "floors_items",
@@ -28,6 +30,27 @@ class Floor(Base):
     topics = relationship("FloorTopic", back_populates="floor")
 
 
+def floor_payloads():
+    """Create a query that selects the floors' columns and relationship ids, without loading related objects."""
+    return select(
+        Floor.id,
+        Floor.label,
+        Floor.level,
+        select(func.array_agg(aggregate_order_by(Room.id, Room.id)))
+        .filter(Room.floor_id == Floor.id)
+        .scalar_subquery()
+        .label("rooms"),
+        select(func.array_agg(aggregate_order_by(floors_items.c.item_id, floors_items.c.item_id)))
+        .filter(floors_items.c.floor_id == Floor.id)
+        .scalar_subquery()
+        .label("samples"),
+        select(func.array_agg(aggregate_order_by(FloorTopic.id, FloorTopic.id)))
+        .filter(FloorTopic.floor_id == Floor.id)
+        .scalar_subquery()
+        .label("topics"),
+    )
+
+
 class FloorModel(BaseModel):
     """Pydantic model for validating a floor."""
 
@@ -44,7 +67,9 @@ class FloorModel(BaseModel):
     @classmethod
     def convert_model_to_ids(cls, value: list[any]) -> str:
         """Convert the lists of child models to lists of ids."""
-        return [v.id for v in value]
+        if value is None:
+            return []
+        return [v if isinstance(v, int) else v.id for v in value]
 
 
 class FloorTopic(Base):
@@ -81,4 +106,17 @@ class FloorTopicModel(BaseModel):
     @classmethod
     def convert_model_to_id(cls, value: any) -> str:
         """Convert the relationship objects to ids."""
+        if isinstance(value, int):
+            return value
         return value.id
+
+
+def floor_topic_payloads():
+    """Create a query that selects the floor-topics' columns and relationship ids, without loading related objects."""
+    return select(
+        FloorTopic.id,
+        FloorTopic.group_id.label("group"),
+        FloorTopic.floor_id.label("floor"),
+        FloorTopic.label,
+        FloorTopic.size,
+    )
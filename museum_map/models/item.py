@@ -1,8 +1,25 @@
 """Models for the item."""
 
+import numpy as np
 from pydantic import BaseModel, ConfigDict, field_validator
-from sqlalchemy import Column, ForeignKey, Index, Integer
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    JSON,
+    Boolean,
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    Unicode,
+    bindparam,
+    cast,
+    false,
+    func,
+    select,
+    update,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy_json import NestedMutableJson
 
 from museum_map.models.base import Base
@@ -18,6 +35,10 @@ class Item(Base):
     room_id = Column(Integer, ForeignKey("rooms.id"))
     attributes = Column(NestedMutableJson)
     sequence = Column(Integer)
+    topic_vector = deferred(Column(LargeBinary))
+    source_key = Column(Unicode, unique=True)
+    content_hash = Column(Unicode(64))
+    deleted = Column(Boolean, nullable=False, default=False, server_default=false())
 
     group = relationship("Group", back_populates="items")
     room = relationship("Room", back_populates="items", primaryjoin="Item.room_id == Room.id")
@@ -27,14 +48,68 @@ Index(Item.group_id)
 Index(Item.room_id)
 
 
+def update_attribute(key):
+    """Create a statement that sets one attribute key per item, given lists of item_id and value parameters."""
+    attributes = Item.__table__.c.attributes
+    return (
+        update(Item.__table__)
+        .where(Item.__table__.c.id == bindparam("item_id"))
+        .values(
+            attributes=cast(
+                cast(attributes, JSONB).op("||")(func.jsonb_build_object(key, bindparam("value", type_=JSONB))),
+                JSON,
+            )
+        )
+    )
+
+
+def encode_vector(vector):
+    """Encode a topic vector as float32 bytes."""
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def decode_vector(data):
+    """Decode a topic vector into a read-only float32 view onto the stored bytes."""
+    return np.frombuffer(data, dtype=np.float32)
+
+
+async def load_vectors(dbsession, item_ids):
+    """Load the topic vectors for the given item ids, returning a dictionary of zero-copy views."""
+    result = await dbsession.execute(select(Item.id, Item.topic_vector).filter(Item.id.in_(item_ids)))
+    return {item_id: decode_vector(data) for item_id, data in result if data is not None}
+
+
+def item_payloads(fields):
+    """Create a query that selects the items' columns and only the given attributes, without loading related objects."""
+    return select(
+        Item.id,
+        Item.group_id,
+        Item.room_id,
+        Item.sequence,
+        *[Item.attributes[field] for field in fields],
+    )
+
+
+def item_payload(row, fields):
+    """Convert a row selected by item_payloads into an item payload, omitting all missing attributes."""
+    item_id, group_id, room_id, sequence, *values = row
+    return {
+        "id": item_id,
+        "group": group_id,
+        "room": room_id,
+        "sequence": sequence,
+        "attributes": {field: value for field, value in zip(fields, values, strict=True) if value is not None},
+    }
+
+
 class ItemModel(BaseModel):
     """Pydantic model for validating items."""
 
     id: int
-    group: int
-    room: int
+    group: int | None
+    room: int | None
     attributes: dict
-    sequence: int
+    sequence: int | None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -42,7 +117,7 @@ class ItemModel(BaseModel):
     @classmethod
     def convert_model_to_ids(cls, value: any) -> int:
         """Convert the child models to ids."""
-        if value is not None:
+        if value is not None and not isinstance(value, int):
             return value.id
         else:
-            return None
+            return value
@@ -1,21 +1,27 @@
 """Models for the user."""
 
-from sqlalchemy import Column, Float, ForeignKey, Index, Integer, Unicode
-from sqlalchemy_json import NestedMutableJson
+from sqlalchemy import DDL, Column, Float, ForeignKey, Index, Integer, Unicode, event
+from sqlalchemy.dialects.postgresql import JSONB
 
 from museum_map.models.base import Base
 
 
 class LogEntry(Base):
-    """Database model representing one log entry."""
+    """Database model representing one log entry, partitioned by month on the timestamp."""
 
     __tablename__ = "log_entries"
+    __table_args__ = {"postgresql_partition_by": "RANGE (timestamp)"}  # noqa: RUF012
 
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(ForeignKey("users.id"))
     action = Column(Unicode(255))
-    timestamp = Column(Float)
-    params = Column(NestedMutableJson)
+    timestamp = Column(Float, primary_key=True)
+    params = Column(JSONB)
 
 
 Index(LogEntry.user_id)
+
+# Entries outside all monthly partitions are stored in the default partition
+event.listen(
+    LogEntry.__table__, "after_create", DDL("CREATE TABLE log_entries_default PARTITION OF log_entries DEFAULT")
+)
@@ -1,11 +1,13 @@
 """Models for the rooms."""
 
 from pydantic import BaseModel, ConfigDict, field_validator
-from sqlalchemy import Column, ForeignKey, Index, Integer, Unicode
+from sqlalchemy import Column, ForeignKey, Index, Integer, Unicode, func, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by
 from sqlalchemy.orm import relationship
 from sqlalchemy_json import NestedMutableJson
 
 from museum_map.models.base import Base
+from museum_map.models.item import Item
 
 
 class Room(Base):
@@ -32,6 +34,23 @@ Index(Room.group_id)
 Index(Room.item_id)
 
 
+def room_payloads():
+    """Create a query that selects the rooms' columns and the ids of their items, without loading related objects."""
+    return select(
+        Room.id,
+        Room.number,
+        Room.label,
+        Room.position,
+        Room.group_id.label("group"),
+        Room.floor_id.label("floor"),
+        Room.item_id.label("sample"),
+        select(func.array_agg(aggregate_order_by(Item.id, Item.sequence, Item.id)))
+        .filter(Item.room_id == Room.id)
+        .scalar_subquery()
+        .label("items"),
+    )
+
+
 class RoomModel(BaseModel):
     """Pydantic model representing a room."""
 
@@ -50,10 +69,14 @@ class RoomModel(BaseModel):
     @classmethod
     def convert_models_to_ids(cls, value: list[any]) -> str:
         """Convert the lists of child models to lists of ids."""
-        return [v.id for v in value]
+        if value is None:
+            return []
+        return [v if isinstance(v, int) else v.id for v in value]
 
     @field_validator("group", "floor", "sample", mode="before")
     @classmethod
     def convert_model_to_ids(cls, value: list[any]) -> str:
         """Convert the child models to ids."""
+        if isinstance(value, int):
+            return value
         return value.id
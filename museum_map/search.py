@@ -0,0 +1,257 @@
+"""Search backends for the Meilisearch service and for the embedded, memory-mapped search index."""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import chain
+
+import numpy as np
+from meilisearch_python_sdk import AsyncClient
+
+logger = logging.getLogger(__name__)
+
+POINTER_NAME = "current"
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_CHARACTER = chr(0x10FFFF)
+EMPTY_RESULT = np.zeros(0, dtype=np.int32)
+
+
+def tokenise(text):
+    """Split the text into lower-case tokens, with all diacritics removed."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return TOKEN_PATTERN.findall("".join(character for character in text if not unicodedata.combining(character)))
+
+
+def document_text(value):
+    """Yield all searchable text in the document value, ignoring internal attributes."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, int | float) and not isinstance(value, bool):
+        yield str(value)
+    elif isinstance(value, list):
+        for part in value:
+            yield from document_text(part)
+    elif isinstance(value, dict):
+        for key, part in value.items():
+            if not key.startswith(("_", "mmap_")):
+                yield from document_text(part)
+
+
+def write_embedded_index(path, version, docs, keep=3):
+    """Build the embedded index for the documents and make it the current version, keeping the latest keep versions."""
+    # Ordering the documents by room makes each room's documents a contiguous range of document indexes
+    docs = sorted(docs, key=lambda doc: (doc["mmap_room"], doc["mmap_id"]))
+    postings = defaultdict(list)
+    for idx, doc in enumerate(docs):
+        for term in {token for text in document_text(doc) for token in tokenise(text)}:
+            postings[term].append(idx)
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+    doc_rooms = np.array([doc["mmap_room"] for doc in docs], dtype=np.int32)
+    room_ids, room_starts = np.unique(doc_rooms, return_index=True)
+    arrays = {
+        "offsets": offsets,
+        "postings": np.fromiter(
+            chain.from_iterable(postings[term] for term in terms), dtype=np.int32, count=int(offsets[-1])
+        ),
+        "doc_items": np.array([doc["mmap_id"] for doc in docs], dtype=np.int32),
+        "doc_rooms": doc_rooms,
+        "doc_floors": np.array([doc["mmap_floor"] for doc in docs], dtype=np.int32),
+        "room_ids": room_ids.astype(np.int32),
+        "room_offsets": np.append(room_starts, len(docs)).astype(np.int64),
+    }
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, version)
+    # A temporary directory left behind by an interrupted build is removed, as it would otherwise block every build
+    shutil.rmtree(f"{target}.tmp", ignore_errors=True)
+    os.makedirs(f"{target}.tmp")
+    for name, array in arrays.items():
+        np.save(os.path.join(f"{target}.tmp", f"{name}.npy"), array)
+    with open(os.path.join(f"{target}.tmp", "terms.json"), "w") as out_f:
+        json.dump(terms, out_f, ensure_ascii=False)
+    os.replace(f"{target}.tmp", target)
+    pointer = os.path.join(path, POINTER_NAME)
+    with open(f"{pointer}.tmp", "w") as out_f:
+        out_f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)
+    versions = sorted(
+        filename
+        for filename in os.listdir(path)
+        if os.path.isdir(os.path.join(path, filename)) and not filename.endswith(".tmp")
+    )
+    for old_version in versions[:-keep]:
+        shutil.rmtree(os.path.join(path, old_version))
+
+
+def current_embedded_version(path):
+    """Read the current embedded index version from the pointer file."""
+    pointer = os.path.join(path, POINTER_NAME)
+    if os.path.exists(pointer):
+        with open(pointer) as in_f:
+            return in_f.read().strip()
+    return None
+
+
+class EmbeddedIndex:
+    """Inverted index over the item documents, with the postings and document arrays memory-mapped from disk."""
+
+    def __init__(self, path, version):
+        """Load the term list and memory-map the arrays of the index version."""
+        self.version = version
+        directory = os.path.join(path, version)
+        with open(os.path.join(directory, "terms.json")) as in_f:
+            self._terms = json.load(in_f)
+        self._offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self._postings = np.load(os.path.join(directory, "postings.npy"), mmap_mode="r")
+        self._doc_items = np.load(os.path.join(directory, "doc_items.npy"), mmap_mode="r")
+        self._doc_rooms = np.load(os.path.join(directory, "doc_rooms.npy"), mmap_mode="r")
+        self._doc_floors = np.load(os.path.join(directory, "doc_floors.npy"), mmap_mode="r")
+        self._room_ids = np.load(os.path.join(directory, "room_ids.npy"), mmap_mode="r")
+        self._room_offsets = np.load(os.path.join(directory, "room_offsets.npy"), mmap_mode="r")
+
+    def _documents(self, start, end):
+        """Return the sorted indexes of the documents that contain any of the terms in the term range."""
+        if end <= start:
+            return EMPTY_RESULT
+        if end - start == 1:
+            return np.asarray(self._postings[self._offsets[start] : self._offsets[end]])
+        return np.unique(
+            np.concatenate([self._postings[self._offsets[idx] : self._offsets[idx + 1]] for idx in range(start, end)])
+        )
+
+    def match(self, q):
+        """Return the sorted indexes of the documents that match the query or None if the query is empty."""
+        # Documents must contain all terms, with the last term matched as a prefix, as it may not be complete yet
+        tokens = tokenise(q)
+        if not tokens:
+            return None
+        result = None
+        for idx, token in enumerate(tokens):
+            start = bisect_left(self._terms, token)
+            if idx == len(tokens) - 1:
+                end = bisect_left(self._terms, token + MAX_CHARACTER, start)
+            elif start < len(self._terms) and self._terms[start] == token:
+                end = start + 1
+            else:
+                end = start
+            documents = self._documents(start, end)
+            result = documents if result is None else np.intersect1d(result, documents, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
+
+    def facets(self, q):
+        """Return the floors and rooms that contain documents matching the query."""
+        matches = self.match(q)
+        if matches is None:
+            return {"floors": np.unique(self._doc_floors).tolist(), "rooms": np.asarray(self._room_ids).tolist()}
+        return {
+            "floors": np.unique(self._doc_floors[matches]).tolist(),
+            "rooms": np.unique(self._doc_rooms[matches]).tolist(),
+        }
+
+    def room_items(self, rid, q, limit):
+        """Return the ids of the items in the room that match the query, up to the limit."""
+        idx = int(np.searchsorted(self._room_ids, rid))
+        if idx == len(self._room_ids) or self._room_ids[idx] != rid:
+            return []
+        start, end = self._room_offsets[idx], self._room_offsets[idx + 1]
+        matches = self.match(q)
+        if matches is None:
+            return self._doc_items[start : min(end, start + limit)].tolist()
+        low, high = np.searchsorted(matches, [start, end])
+        return self._doc_items[matches[low : min(high, low + limit)]].tolist()
+
+
+class EmbeddedBackend:
+    """Search backend using the embedded index, which is reloaded when a new version has been built."""
+
+    def __init__(self, path):
+        """Initialise the backend. The index is only loaded when its version is first checked."""
+        self._path = path
+        self._index = None
+
+    async def start(self):
+        """Start the backend."""
+
+    async def stop(self):
+        """Release the index."""
+        self._index = None
+
+    async def version(self):
+        """Return the current index version, loading it if it has changed."""
+        version = current_embedded_version(self._path)
+        if version is None:
+            self._index = None
+        elif self._index is None or self._index.version != version:
+            self._index = await asyncio.to_thread(EmbeddedIndex, self._path, version)
+            logger.info(f"Loaded embedded search index version {version}")
+        return version
+
+    async def facets(self, q):
+        """Return the floors and rooms that contain items matching the query."""
+        if self._index is None:
+            return {"floors": [], "rooms": []}
+        return self._index.facets(q)
+
+    async def room_items(self, rid, q, limit):
+        """Return the ids of the items in the room that match the query."""
+        if self._index is None:
+            return []
+        return self._index.room_items(rid, q, limit)
+
+
+class MeilisearchBackend:
+    """Search backend using the Meilisearch service."""
+
+    def __init__(self, url, key):
+        """Initialise the backend. The client is only created by calling start."""
+        self._url = url
+        self._key = key
+        self._client = None
+        self._index = None
+
+    async def start(self):
+        """Create the search client."""
+        if self._client is None:
+            self._client = AsyncClient(self._url, self._key)
+
+    async def stop(self):
+        """Close the search client."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._index = None
+
+    async def version(self):
+        """Return the version of the index, which changes whenever the index is rebuilt or updated."""
+        self._index = await self._client.get_index("items")
+        return (self._index.created_at, self._index.updated_at)
+
+    async def facets(self, q):
+        """Return the floors and rooms that contain items matching the query."""
+        result = await self._index.search(q, limit=1, facets=["mmap_room", "mmap_floor"])
+        facets = result.facet_distribution
+        return {
+            "floors": [int(key) for key in facets["mmap_floor"].keys()],
+            "rooms": [int(key) for key in facets["mmap_room"].keys()],
+        }
+
+    async def room_items(self, rid, q, limit):
+        """Return the ids of the items in the room that match the query."""
+        result = await self._index.search(q, limit=limit, filter=[f"mmap_room = {rid!s}"])
+        return [item["mmap_id"] for item in result.hits]
+
+
+def create_backend(search_settings):
+    """Create the search backend configured in the search settings."""
+    if search_settings.backend == "embedded":
+        return EmbeddedBackend(search_settings.path)
+    return MeilisearchBackend(str(search_settings.url), search_settings.key)
@@ -1,20 +1,42 @@
 """The main Museum Map server entry-point."""
 
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
 from fastapi.staticfiles import StaticFiles
 
 from museum_map.server import api
-from museum_map.settings import init_settings
+from museum_map.server.cache import cache_middleware, database_version
+from museum_map.server.images import ImageFiles
+from museum_map.server.search import service as search_service
+from museum_map.server.tracking import queue as tracking_queue
+from museum_map.settings import init_settings, settings
+from museum_map.snapshot import store
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):  # noqa: ARG001
+    """Load the published snapshot and data version, and start the tracking queue and search service."""
+    await store.current()
+    if settings.response_cache.enabled:
+        await database_version.start()
+    await tracking_queue.start()
+    await search_service.start()
+    yield
+    await search_service.stop()
+    await tracking_queue.stop()
+    await database_version.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+app.middleware("http")(cache_middleware)
 
 app.mount("/app", StaticFiles(packages=[("museum_map.server", "frontend/dist")], html=True), name="static")
 app.include_router(api.router)
 if os.path.isdir(init_settings.images_path):
-    app.mount("/images", StaticFiles(directory=init_settings.images_path))
+    app.mount("/images", ImageFiles(directory=init_settings.images_path))
 
 
 @app.get("/")
@@ -9,7 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from museum_map.__about__ import __tables__, __version__
 from museum_map.models import db_session
-from museum_map.server.api import config, floor_topics, floors, items, picks, rooms, search, tracking
+from museum_map.server.api import config, floor_topics, floors, items, picks, rooms, search, stats, tracking
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api")
@@ -20,6 +20,7 @@ router.include_router(items.router)
 router.include_router(picks.router)
 router.include_router(rooms.router)
 router.include_router(search.router)
+router.include_router(stats.router)
 router.include_router(tracking.router)
 
 
@@ -28,8 +29,11 @@ async def index(dbsession: Annotated[AsyncSession, Depends(db_session)]) -> dict
     """Return the application status."""
     try:
         logger.debug("API readyness check")
+        # Partitions of the tracking log table are excluded, as they are created and dropped over time
         query = text(
-            "SELECT tablename FROM pg_catalog.pg_tables WHERE schemaname != 'pg_catalog' AND schemaname != 'information_schema'"  # noqa: E501
+            "SELECT c.relname FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relkind IN ('r', 'p') AND NOT c.relispartition "
+            "AND n.nspname != 'pg_catalog' AND n.nspname != 'information_schema'"
         )
         tables = set((await dbsession.execute(query)).scalars())
         return {"ready": tables == __tables__, "version": __version__}
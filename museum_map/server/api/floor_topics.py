@@ -3,19 +3,20 @@
 import logging
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from museum_map.models import FloorTopic, FloorTopicModel, db_session
+from museum_map.models import FloorTopicModel, db_session, floor_topic_payloads
+from museum_map.snapshot import store
 
 router = APIRouter(prefix="/floor-topics")
 logger = logging.getLogger(__name__)
 
 
 @router.get("/", response_model=list[FloorTopicModel])
-async def get_floor_topics(dbsession: Annotated[AsyncSession, Depends(db_session)]) -> list[FloorTopic]:
+async def get_floor_topics(dbsession: Annotated[AsyncSession, Depends(db_session)]) -> list[dict]:
     """Retrieve all floor topics."""
-    query = select(FloorTopic).options(selectinload(FloorTopic.group)).options(selectinload(FloorTopic.floor))
-    return (await dbsession.execute(query)).scalars()
+    snapshot = await store.current()
+    if snapshot is not None:
+        return Response(snapshot.floor_topics, media_type="application/json")
+    return [row._asdict() for row in await dbsession.execute(floor_topic_payloads())]
@@ -3,12 +3,11 @@
 import logging
 from typing import Annotated
 
-from fastapi import APIRouter, Depends
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from museum_map.models import Floor, FloorModel, Room, RoomModel, db_session
+from museum_map.models import Floor, FloorModel, Room, RoomModel, db_session, floor_payloads, room_payloads
+from museum_map.snapshot import EMPTY_LIST, store
 
 router = APIRouter(prefix="/floors")
 logger = logging.getLogger(__name__)
@@ -17,26 +16,18 @@ logger = logging.getLogger(__name__)
 @router.get("/", response_model=list[FloorModel])
 async def get_floors(dbsession: Annotated[AsyncSession, Depends(db_session)]):
     """Retrieve all floors."""
-    query = (
-        select(Floor)
-        .order_by(Floor.level)
-        .options(selectinload(Floor.rooms))
-        .options(selectinload(Floor.samples))
-        .options(selectinload(Floor.topics))
-    )
-    return (await dbsession.execute(query)).scalars()
+    snapshot = await store.current()
+    if snapshot is not None:
+        return Response(snapshot.floors, media_type="application/json")
+    query = floor_payloads().order_by(Floor.level)
+    return [row._asdict() for row in await dbsession.execute(query)]
 
 
 @router.get("/{fid}/rooms", response_model=list[RoomModel])
-async def get_floor_rooms(fid: int, dbsession: Annotated[AsyncSession, Depends(db_session)]) -> list[Room]:
+async def get_floor_rooms(fid: int, dbsession: Annotated[AsyncSession, Depends(db_session)]) -> list[dict]:
     """Retrieve all rooms on a floor."""
-    query = (
-        select(Room)
-        .filter(Room.floor_id == fid)
-        .order_by(Room.number)
-        .options(selectinload(Room.group))
-        .options(selectinload(Room.floor))
-        .options(selectinload(Room.items))
-        .options(selectinload(Room.sample))
-    )
-    return (await dbsession.execute(query)).scalars()
+    snapshot = await store.current()
+    if snapshot is not None:
+        return Response(snapshot.floor_rooms.get(fid, EMPTY_LIST), media_type="application/json")
+    query = room_payloads().filter(Room.floor_id == fid).order_by(Room.number)
+    return [row._asdict() for row in await dbsession.execute(query)]
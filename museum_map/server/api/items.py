@@ -3,33 +3,56 @@
 import logging
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from museum_map.models import Item, ItemModel, db_session
+from museum_map.models import Item, ItemModel, db_session, item_payload, item_payloads
+from museum_map.settings import settings
+from museum_map.snapshot import store
 
 router = APIRouter(prefix="/items")
 logger = logging.getLogger(__name__)
 
 
+def item_fields(fields: str | None) -> list[str]:
+    """Determine the item attributes to return from the comma-separated fields, excluding all internal attributes."""
+    if fields is None:
+        return settings.app.item.public_attributes()
+    return list(dict.fromkeys(field for field in (f.strip() for f in fields.split(",")) if field and field[0] != "_"))
+
+
 @router.get("/", response_model=list[ItemModel])
 async def get_items(
     iid: Annotated[list[int] | None, Query()],
     dbsession: Annotated[AsyncSession, Depends(db_session)],
+    fields: Annotated[str | None, Query()] = None,
 ):
     """Retrieve items."""
-    query = select(Item).filter(Item.id.in_(iid)).options(selectinload(Item.group)).options(selectinload(Item.room))
-    return (await dbsession.execute(query)).scalars()
+    if fields is None:
+        # Items that are not in the snapshot, because they are not placed in a room, are fetched from the database
+        snapshot = await store.current()
+        if snapshot is not None and all(item_id in snapshot.items for item_id in iid):
+            return Response(snapshot.item_list(iid), media_type="application/json")
+    attributes = item_fields(fields)
+    query = item_payloads(attributes).filter(Item.id.in_(iid))
+    return [item_payload(row, attributes) for row in await dbsession.execute(query)]
 
 
 @router.get("/{iid}", response_model=ItemModel)
-async def get_item(iid: int, dbsession: Annotated[AsyncSession, Depends(db_session)]):
+async def get_item(
+    iid: int,
+    dbsession: Annotated[AsyncSession, Depends(db_session)],
+    fields: Annotated[str | None, Query()] = None,
+):
     """Fetch a single item."""
-    query = select(Item).filter(Item.id == iid).options(selectinload(Item.group)).options(selectinload(Item.room))
-    item = (await dbsession.execute(query)).scalar()
+    if fields is None:
+        snapshot = await store.current()
+        if snapshot is not None and iid in snapshot.items:
+            return Response(snapshot.items[iid], media_type="application/json")
+    attributes = item_fields(fields)
+    query = item_payloads(attributes).filter(Item.id == iid)
+    item = (await dbsession.execute(query)).first()
     if item is not None:
-        return item
+        return item_payload(item, attributes)
     else:
         raise HTTPException(404)
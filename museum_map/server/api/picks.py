@@ -3,48 +3,87 @@
 import logging
 import math
 from datetime import UTC, datetime
+from random import sample
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import func, select
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from museum_map.models import Item, ItemModel, db_session
+from museum_map.models import Item, ItemModel, db_session, item_payload, item_payloads
+from museum_map.settings import settings
+from museum_map.snapshot import store
 
 router = APIRouter(prefix="/picks")
 logger = logging.getLogger(__name__)
 
+RANDOM_ITEMS = 12
+
+
+def current_day():
+    """Return the number of the current day."""
+    return math.floor(datetime.now(tz=UTC).timestamp() / 86400)
+
+
+def day_index(count):
+    """Return the index of the item of the day in the ordered list of count items."""
+    # The item of the day is picked from the items in rooms only, so that it can always be shown in its room. This
+    # picks a different item than the original offset into all items, as items outside rooms are no longer counted
+    return (current_day() + 1) % count
+
+
+class ItemIds:
+    """In-memory array of the ids of all items in rooms, used when no snapshot has been published."""
+
+    def __init__(self):
+        """Initialise the empty array. It is loaded on first use and reloaded daily."""
+        self._ids = []
+        self._day = None
+
+    async def get(self, dbsession):
+        """Return the ordered array of item ids."""
+        if self._day != current_day():
+            query = select(Item.id).filter(Item.room_id.is_not(None)).order_by(Item.id)
+            self._ids = list(await dbsession.scalars(query))
+            self._day = current_day()
+        return self._ids
+
+
+item_ids = ItemIds()
+
+
+async def fetch_items(dbsession, ids):
+    """Fetch the public payloads of the items with the given ids, in the order of the ids."""
+    attributes = settings.app.item.public_attributes()
+    query = item_payloads(attributes).filter(Item.id.in_(ids))
+    items = {row[0]: item_payload(row, attributes) for row in await dbsession.execute(query)}
+    return [items[item_id] for item_id in ids if item_id in items]
+
 
 @router.get("/item-of-the-day", response_model=ItemModel)
 async def get_item_of_the_day(dbsession: Annotated[AsyncSession, Depends(db_session)]):
     """Retrieve the item of the day."""
-    query = select(func.count()).select_from(Item)
-    total = (await dbsession.execute(query)).scalar()
-    row_nr = math.floor(datetime.now(tz=UTC).timestamp() / 86400) % total + 1
-    query = (
-        select(Item)
-        .order_by(Item.id)
-        .offset(row_nr)
-        .limit(1)
-        .options(selectinload(Item.group))
-        .options(selectinload(Item.room))
-    )
-    item = (await dbsession.execute(query)).scalar()
-    if item is not None:
-        return item
-    else:
+    snapshot = await store.current()
+    if snapshot is not None:
+        if snapshot.item_ids:
+            return Response(
+                snapshot.items[snapshot.item_ids[day_index(len(snapshot.item_ids))]], media_type="application/json"
+            )
         raise HTTPException(404)
+    ids = await item_ids.get(dbsession)
+    if ids:
+        items = await fetch_items(dbsession, [ids[day_index(len(ids))]])
+        if items:
+            return items[0]
+    raise HTTPException(404)
 
 
 @router.get("/random-items", response_model=list[ItemModel])
-async def get_floors(dbsession: Annotated[AsyncSession, Depends(db_session)]):
+async def get_random_items(dbsession: Annotated[AsyncSession, Depends(db_session)]):
     """Retrieve a random selection of items."""
-    query = (
-        select(Item)
-        .order_by(func.random())
-        .limit(12)
-        .options(selectinload(Item.group))
-        .options(selectinload(Item.room))
-    )
-    return (await dbsession.execute(query)).scalars()
+    snapshot = await store.current()
+    if snapshot is not None:
+        ids = sample(snapshot.item_ids, min(RANDOM_ITEMS, len(snapshot.item_ids)))
+        return Response(snapshot.item_list(ids), media_type="application/json")
+    ids = await item_ids.get(dbsession)
+    return await fetch_items(dbsession, sample(ids, min(RANDOM_ITEMS, len(ids))))
@@ -3,42 +3,44 @@
 import logging
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
 
-from museum_map.models import Item, ItemModel, Room, RoomModel, db_session
+from museum_map.models import Item, ItemModel, Room, RoomModel, db_session, item_payload, item_payloads, room_payloads
+from museum_map.server.api.items import item_fields
+from museum_map.snapshot import EMPTY_LIST, store
 
 router = APIRouter(prefix="/rooms")
 logger = logging.getLogger(__name__)
 
 
 @router.get("/{rid}", response_model=RoomModel)
-async def get_room(rid: int, dbsession: Annotated[AsyncSession, Depends(db_session)]) -> Room:
+async def get_room(rid: int, dbsession: Annotated[AsyncSession, Depends(db_session)]) -> dict:
     """Retrieve rooms."""
-    query = (
-        select(Room)
-        .filter(Room.id == rid)
-        .options(selectinload(Room.group))
-        .options(selectinload(Room.floor))
-        .options(selectinload(Room.items))
-        .options(selectinload(Room.sample))
-    )
-    room = (await dbsession.execute(query)).scalar()
+    snapshot = await store.current()
+    if snapshot is not None:
+        if rid in snapshot.rooms:
+            return Response(snapshot.rooms[rid], media_type="application/json")
+        raise HTTPException(404)
+    query = room_payloads().filter(Room.id == rid)
+    room = (await dbsession.execute(query)).first()
     if room is not None:
-        return room
+        return room._asdict()
     else:
         raise HTTPException(404)
 
 
 @router.get("/{rid}/items", response_model=list[ItemModel])
-async def get_room_items(rid: int, dbsession: Annotated[AsyncSession, Depends(db_session)]) -> list[Item]:
+async def get_room_items(
+    rid: int,
+    dbsession: Annotated[AsyncSession, Depends(db_session)],
+    fields: Annotated[str | None, Query()] = None,
+) -> list[dict]:
     """Retrieve all items in a room."""
-    query = (
-        (select(Item).filter(Item.room_id == rid))
-        .order_by(Item.sequence)
-        .options(selectinload(Item.room))
-        .options(selectinload(Item.group))
-    )
-    return (await dbsession.execute(query)).scalars()
+    if fields is None:
+        snapshot = await store.current()
+        if snapshot is not None:
+            return Response(snapshot.room_items.get(rid, EMPTY_LIST), media_type="application/json")
+    attributes = item_fields(fields)
+    query = item_payloads(attributes).filter(Item.room_id == rid).order_by(Item.sequence)
+    return [item_payload(row, attributes) for row in await dbsession.execute(query)]
@@ -0,0 +1,24 @@
+"""Routes for accessing the server statistics."""
+
+import logging
+
+from fastapi import APIRouter
+
+from museum_map.models import async_engine, pool_statistics, tracking_engine
+from museum_map.server.cache import cache
+from museum_map.server.search import service as search_service
+from museum_map.server.tracking import queue
+
+router = APIRouter(prefix="/stats")
+logger = logging.getLogger(__name__)
+
+
+@router.get("/")
+async def get_stats() -> dict:
+    """Retrieve the server statistics."""
+    return {
+        "response_cache": cache.statistics(),
+        "tracking": queue.statistics(),
+        "search": search_service.statistics(),
+        "database": {"api": pool_statistics(async_engine), "tracking": pool_statistics(tracking_engine)},
+    }
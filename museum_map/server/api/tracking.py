@@ -4,19 +4,20 @@ import logging
 from typing import Annotated
 from uuid import uuid4
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import UUID4, BaseModel
 from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from museum_map.models import LogEntry, User, UserModel, db_session
+from museum_map.models import LogEntry, User, UserModel, tracking_session
+from museum_map.server.tracking import queue
 
 router = APIRouter(prefix="/tracking")
 logger = logging.getLogger(__name__)
 
 
 @router.post("/register", response_model=UserModel)
-async def register_user(dbsession: Annotated[AsyncSession, Depends(db_session)]) -> User:
+async def register_user(dbsession: Annotated[AsyncSession, Depends(tracking_session)]) -> User:
     """Register a new tracking user."""
     user = User(public_id=str(uuid4()))
     dbsession.add(user)
@@ -25,10 +26,11 @@ async def register_user(dbsession: Annotated[AsyncSession, Depends(db_session)])
 
 
 @router.delete("/{uid}", status_code=204)
-async def delete_user(uid: UUID4, dbsession: Annotated[AsyncSession, Depends(db_session)]) -> None:
+async def delete_user(uid: UUID4, dbsession: Annotated[AsyncSession, Depends(tracking_session)]) -> None:
     """Delete a user and all their logs."""
     query = select(User).filter(User.public_id == str(uid))
     user = (await dbsession.execute(query)).scalar()
+    queue.forget(str(uid))
     if user:
         query = delete(LogEntry).filter(LogEntry.user_id == user.id)
         await dbsession.execute(query)
@@ -46,14 +48,14 @@ class TrackingAction(BaseModel):
 
 @router.post("/track/{uid}", status_code=204)
 async def track_activities(
-    uid: UUID4, actions: list[TrackingAction], dbsession: Annotated[AsyncSession, Depends(db_session)]
+    uid: UUID4, actions: list[TrackingAction], dbsession: Annotated[AsyncSession, Depends(tracking_session)]
 ) -> None:
-    """Store the activities for the tracking user."""
-    query = select(User).filter(User.public_id == str(uid))
-    user = (await dbsession.execute(query)).scalar()
-    if user:
-        for action in actions:
-            dbsession.add(
-                LogEntry(user_id=user.id, action=action.action, timestamp=action.timestamp, params=action.params)
-            )
-        await dbsession.commit()
+    """Queue the activities for the tracking user."""
+    user_id = await queue.user_id(dbsession, str(uid))
+    if user_id is not None:
+        entries = [
+            {"user_id": user_id, "action": action.action, "timestamp": action.timestamp, "params": action.params}
+            for action in actions
+        ]
+        if not queue.submit(entries):
+            raise HTTPException(503, headers={"Retry-After": "5"})
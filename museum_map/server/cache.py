@@ -0,0 +1,184 @@
+"""In-process response cache with ETag support for the read-only API routes."""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import suppress
+from hashlib import sha256
+
+from fastapi import Request, Response
+from sqlalchemy import exc, select
+
+from museum_map.models import DataVersion, async_sessionmaker
+from museum_map.settings import settings
+from museum_map.snapshot import store
+
+logger = logging.getLogger(__name__)
+
+CACHEABLE_PATHS = ("/api/config/", "/api/floors/", "/api/floor-topics/", "/api/items/", "/api/rooms/")
+# The cache sets these headers itself and the length is set for the body when the response is built
+GENERATED_HEADERS = (b"content-length", b"etag", b"cache-control")
+
+
+class DatabaseVersion:
+    """Data version counter of the database, which is shared by all workers and re-read by a background task."""
+
+    def __init__(self, check_interval):
+        """Initialise the version as not yet read. The background task is only started by calling start."""
+        self._check_interval = check_interval
+        self._task = None
+        self.version = None
+
+    async def start(self):
+        """Read the current version and start the background task that re-reads it after every check interval."""
+        if self._task is None:
+            await self._refresh()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task."""
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        """Re-read the version until the task is cancelled."""
+        while True:
+            await asyncio.sleep(self._check_interval)
+            await self._refresh()
+
+    async def _refresh(self):
+        """Read the version, which is None if the database has no version counter or cannot be reached."""
+        try:
+            async with async_sessionmaker() as dbsession:
+                row = (await dbsession.execute(select(DataVersion.created, DataVersion.version))).first()
+        except exc.ProgrammingError:
+            logger.error("The database has no data version counter, run db init to add it")
+            row = None
+        except (exc.SQLAlchemyError, OSError) as e:
+            logger.error(f"Reading the data version failed: {e}")
+            row = None
+        self.version = f"db-{row[0]}-{row[1]}" if row is not None else None
+
+
+class ResponseCache:
+    """Size-bounded LRU cache of serialised response bodies for a single data version."""
+
+    def __init__(self, max_bytes):
+        """Initialise the empty cache."""
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def set_version(self, version):
+        """Set the current data version, invalidating all entries if it has changed."""
+        if version != self.version:
+            if self.version is not None:
+                logger.info(f"Data version changed to {version}, invalidating the response cache")
+            self.invalidate()
+            self.version = version
+
+    def invalidate(self):
+        """Remove all entries."""
+        self._entries.clear()
+        self._size = 0
+        self.invalidations = self.invalidations + 1
+
+    def etag(self, key):
+        """Return the strong ETag for the key in the current data version."""
+        return f'"{sha256(f"{self.version}|{key}".encode()).hexdigest()[:32]}"'
+
+    def get(self, key):
+        """Return the cached body and headers for the key or None."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+        else:
+            self.misses = self.misses + 1
+        return entry
+
+    def put(self, key, version, body, headers):
+        """Add the body, if it was generated for the current data version, evicting the least recently used ones."""
+        if version != self.version or len(body) > self._max_bytes:
+            return
+        if key in self._entries:
+            self._size = self._size - len(self._entries.pop(key)[0])
+        self._entries[key] = (body, headers)
+        self._size = self._size + len(body)
+        while self._size > self._max_bytes:
+            _, (old_body, _) = self._entries.popitem(last=False)
+            self._size = self._size - len(old_body)
+            self.evictions = self.evictions + 1
+
+    def statistics(self):
+        """Return the cache statistics."""
+        return {
+            "version": self.version,
+            "entries": len(self._entries),
+            "size": self._size,
+            "max_size": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def matches_etag(header, etag):
+    """Check whether the If-None-Match header matches the ETag."""
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def cached_response(body, route_headers, headers):
+    """Build the response from the body and the headers set by the route and by the cache."""
+    response = Response(body, headers=headers)
+    response.raw_headers.extend(route_headers)
+    return response
+
+
+cache = ResponseCache(settings.response_cache.max_size)
+database_version = DatabaseVersion(settings.response_cache.version_check_interval)
+
+
+async def cache_middleware(request: Request, call_next):
+    """Answer conditional requests and serve cached responses for the read-only routes."""
+    if (
+        not settings.response_cache.enabled
+        or request.method != "GET"
+        or not request.url.path.startswith(CACHEABLE_PATHS)
+    ):
+        return await call_next(request)
+    # Responses are served from the published snapshot if there is one and otherwise from the database
+    snapshot = await store.current()
+    version = snapshot.version if snapshot is not None else database_version.version
+    if version is None:
+        return await call_next(request)
+    cache.set_version(version)
+    key = f"{request.url.path}?{request.url.query}"
+    headers = {"ETag": cache.etag(key), "Cache-Control": "no-cache"}
+    if matches_etag(request.headers.get("If-None-Match"), headers["ETag"]):
+        cache.not_modified = cache.not_modified + 1
+        return Response(status_code=304, headers=headers)
+    entry = cache.get(key)
+    if entry is not None:
+        return cached_response(entry[0], entry[1], headers)
+    response = await call_next(request)
+    if response.status_code != 200:  # noqa: PLR2004
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    route_headers = [(name, value) for name, value in response.raw_headers if name not in GENERATED_HEADERS]
+    cache.put(key, version, body, route_headers)
+    return cached_response(body, route_headers, headers)
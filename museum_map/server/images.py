@@ -0,0 +1,63 @@
+"""Static image serving with configurable caching and negotiation of the WebP and AVIF variants."""
+
+import stat
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+
+from museum_map.settings import settings
+
+# Variants in order of preference, as generated by the image pipeline next to each JPEG derivative
+VARIANTS = (("image/avif", ".avif"), ("image/webp", ".webp"))
+CACHEABLE_STATUS = (200, 206, 304)
+
+
+def accepted_types(accept):
+    """Return the media types in the Accept header that are not refused with a quality of zero."""
+    types = set()
+    for part in accept.split(","):
+        media_type, *parameters = part.split(";")
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            types.add(media_type.strip().lower())
+    return types
+
+
+class ImageFiles(StaticFiles):
+    """Static files for the images, which serves the best variant the client accepts."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialise the static files and the Cache-Control header value."""
+        super().__init__(*args, **kwargs)
+        # Images are regenerated in place under the same URL, so by default they are only cached briefly and then
+        # revalidated with their ETag. Only deployments that never regenerate images should mark them as immutable
+        self._cache_control = f"public, max-age={settings.images.max_age}"
+        if settings.images.immutable:
+            self._cache_control = f"{self._cache_control}, immutable"
+
+    async def get_response(self, path, scope):
+        """Return the response for the image, using a WebP or AVIF variant of a JPEG if one exists and is accepted."""
+        response = None
+        if path.endswith(".jpg"):
+            accepted = accepted_types(Headers(scope=scope).get("accept", ""))
+            for media_type, extension in VARIANTS:
+                if media_type in accepted:
+                    full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, f"{path[:-4]}{extension}")
+                    if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                        response = self.file_response(full_path, stat_result, scope)
+                        break
+        if response is None:
+            response = await super().get_response(path, scope)
+        if response.status_code in CACHEABLE_STATUS:
+            response.headers["Cache-Control"] = self._cache_control
+            if path.endswith(".jpg"):
+                response.headers["Vary"] = "Accept"
+        return response
@@ -0,0 +1,129 @@
+"""Search service with a long-lived search backend and a result cache."""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from functools import partial
+from time import monotonic
+
+from museum_map.search import create_backend
+from museum_map.settings import settings
+
+logger = logging.getLogger(__name__)
+
+ROOM_LIMIT = 150
+
+
+def normalise_query(q):
+    """Normalise the query's case and whitespace, which do not affect the search results."""
+    return " ".join(q.lower().split())
+
+
+class SearchService:
+    """Search backend wrapper with a TTL/LRU result cache, which is invalidated whenever the search index changes."""
+
+    def __init__(self, backend, ttl, max_entries, check_interval):
+        """Initialise the service. The backend is only started by calling start."""
+        self._backend = backend
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._check_interval = check_interval
+        self._version = None
+        self._last_check = None
+        self._entries = OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def start(self):
+        """Start the search backend."""
+        await self._backend.start()
+
+    async def stop(self):
+        """Stop the search backend."""
+        await self._backend.stop()
+        self._last_check = None
+
+    def invalidate(self):
+        """Remove all cached results."""
+        self._entries.clear()
+        self._pending.clear()
+        self.invalidations = self.invalidations + 1
+
+    async def _check_version(self):
+        """Check the version of the search index, invalidating the cache if the index has been rebuilt or updated."""
+        if self._last_check is not None and monotonic() - self._last_check < self._check_interval:
+            return
+        # Set the check time first, so that concurrent requests use the existing index while it is checked
+        self._last_check = monotonic()
+        version = await self._backend.version()
+        if version != self._version:
+            if self._version is not None:
+                logger.info("Search index changed, invalidating the search cache")
+                self.invalidate()
+            self._version = version
+
+    async def _cached(self, key, fetch):
+        """Return the cached result for the key, joining an identical running search or starting a new one."""
+        await self._check_version()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > monotonic():
+            self._entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry[1]
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced = self.coalesced + 1
+        else:
+            self.misses = self.misses + 1
+            task = asyncio.create_task(fetch())
+            task.add_done_callback(partial(self._store, key, self._version))
+            self._pending[key] = task
+        # Shielded, so that a cancelled request does not cancel the search for the other requests waiting on it
+        return await asyncio.shield(task)
+
+    def _store(self, key, version, task):
+        """Cache the result of the completed search, if it was run against the current index."""
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if task.cancelled() or task.exception() is not None or version != self._version:
+            return
+        self._entries[key] = (monotonic() + self._ttl, task.result())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    async def search(self, q):
+        """Return the floors and rooms that contain items matching the query."""
+        q = normalise_query(q)
+        return await self._cached(("search", q), partial(self._backend.facets, q))
+
+    async def room_search(self, rid, q):
+        """Return the items in the room that match the query."""
+        q = normalise_query(q)
+        return await self._cached(("room", rid, q), partial(self._room_items, rid, q))
+
+    async def _room_items(self, rid, q):
+        """Run the search for items in the room."""
+        return {"items": await self._backend.room_items(rid, q, ROOM_LIMIT)}
+
+    def statistics(self):
+        """Return the cache statistics."""
+        return {
+            "entries": len(self._entries),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+
+service = SearchService(
+    create_backend(settings.search),
+    settings.search.cache_ttl,
+    settings.search.cache_size,
+    settings.search.index_check_interval,
+)
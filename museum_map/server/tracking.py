@@ -0,0 +1,134 @@
+"""Buffered ingestion of tracking events."""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from museum_map.models import LogEntry, User, tracking_sessionmaker
+from museum_map.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TrackingQueue:
+    """Bounded in-process queue of tracking events, which a background task writes to the database in batches."""
+
+    def __init__(self, max_size, batch_size, flush_interval, user_cache_size):
+        """Initialise the queue. The background task is only started by calling start."""
+        self._queue = asyncio.Queue(max_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._users = OrderedDict()
+        self._user_cache_size = user_cache_size
+        self._task = None
+        self.accepted = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+
+    async def start(self):
+        """Start the background flush task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush all queued events and stop the background flush task."""
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+
+    async def user_id(self, dbsession, public_id):
+        """Return the database id of the user with the public id or None if the user does not exist."""
+        if public_id in self._users:
+            self._users.move_to_end(public_id)
+            return self._users[public_id]
+        user_id = (await dbsession.execute(select(User.id).filter(User.public_id == public_id))).scalar()
+        if user_id is not None:
+            self._users[public_id] = user_id
+            if len(self._users) > self._user_cache_size:
+                self._users.popitem(last=False)
+        return user_id
+
+    def forget(self, public_id):
+        """Remove the user from the user cache."""
+        self._users.pop(public_id, None)
+
+    def submit(self, entries):
+        """Add the entries to the queue. If they do not all fit, none are added and False is returned."""
+        if self._queue.maxsize - self._queue.qsize() < len(entries):
+            self.dropped = self.dropped + len(entries)
+            return False
+        for entry in entries:
+            self._queue.put_nowait(entry)
+        self.accepted = self.accepted + len(entries)
+        return True
+
+    async def _run(self):
+        """Collect the queued events and flush them once the batch is full or the flush interval has passed."""
+        stopping = False
+        while not stopping:
+            entry = await self._queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), max(deadline - monotonic(), 0))
+                except TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        """Write the batch with a single multi-row insert."""
+        self.flushes = self.flushes + 1
+        try:
+            async with tracking_sessionmaker() as dbsession:
+                try:
+                    await dbsession.execute(insert(LogEntry), batch)
+                    await dbsession.commit()
+                except IntegrityError:
+                    # Users may have been deleted while their events were queued, so only keep those of existing users
+                    await dbsession.rollback()
+                    user_ids = {entry["user_id"] for entry in batch}
+                    existing = set(await dbsession.scalars(select(User.id).filter(User.id.in_(user_ids))))
+                    self.dropped = self.dropped + len([entry for entry in batch if entry["user_id"] not in existing])
+                    batch = [entry for entry in batch if entry["user_id"] in existing]
+                    if batch:
+                        await dbsession.execute(insert(LogEntry), batch)
+                        await dbsession.commit()
+            self.written = self.written + len(batch)
+        except Exception as e:
+            self.failed = self.failed + len(batch)
+            logger.error(e)
+
+    def statistics(self):
+        """Return the queue statistics."""
+        return {
+            "queued": self._queue.qsize(),
+            "max_size": self._queue.maxsize,
+            "accepted": self.accepted,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "flushes": self.flushes,
+            "cached_users": len(self._users),
+        }
+
+
+queue = TrackingQueue(
+    settings.tracking.queue_size,
+    settings.tracking.batch_size,
+    settings.tracking.flush_interval,
+    settings.tracking.user_cache_size,
+)
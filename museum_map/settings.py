@@ -5,7 +5,7 @@ import logging.config
 import os
 from typing import Literal
 
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, HttpUrl, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from yaml import safe_load
 
@@ -19,10 +19,24 @@ class InitSettings(BaseSettings):
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
 
+class PoolSettings(BaseModel):
+    """Settings for a database connection pool."""
+
+    size: int = 5
+    max_overflow: int = 10
+    timeout: float = 30.0
+    recycle: int = -1
+    pre_ping: bool = False
+
+
 class DatabaseSettings(BaseModel):  # TODO: Need to refactor this into the InitSettings
     """Settings for the database."""
 
     dsn: str
+    pool: PoolSettings = PoolSettings()
+    tracking_pool: PoolSettings = PoolSettings(size=2, max_overflow=3)
+    statement_cache_size: int = 100
+    query_cache_size: int = 500
 
 
 class AppFooter(BaseModel):
@@ -51,6 +65,11 @@ class AppItems(BaseModel):
 
     texts: list[AppItemMetadata]
     fields: list[AppItemMetadata]
+    public_fields: list[str] = ["title", "images"]
+
+    def public_attributes(self) -> list[str]:
+        """Return the names of all item attributes that are shown in the UI."""
+        return list(dict.fromkeys(self.public_fields + [text.name for text in self.texts + self.fields]))
 
 
 class AppSettings(BaseModel):
@@ -62,11 +81,34 @@ class AppSettings(BaseModel):
     item: AppItems
 
 
+class AATSettings(BaseModel):
+    """The AAT vocabulary settings."""
+
+    cache: str = "aat.sqlite"
+    backend: Literal["getty"] | Literal["file"] = "getty"
+    url: str = "http://vocabsservices.getty.edu/AATService.asmx"
+    path: str | None = None
+    concurrency: int = 8
+    rate_limit: float = 10.0
+    retries: int = 3
+    backoff: float = 1.0
+    timeout: float = 300.0
+
+    @model_validator(mode="after")
+    def require_file_path(self):
+        """Require the path if the file backend is used."""
+        if self.backend == "file" and self.path is None:
+            msg = "the file backend requires the AAT file path"
+            raise ValueError(msg)
+        return self
+
+
 class DataHierarchySettings(BaseModel):
     """The data hierarchy settings."""
 
     field: str
     expansions: list[str]
+    aat: AATSettings = AATSettings()
 
 
 class RoomPosition(BaseModel):
@@ -94,10 +136,19 @@ class LayoutSettings(BaseModel):
     rooms: list[RoomSettings]
 
 
+class TopicSettings(BaseModel):
+    """The topic modelling settings."""
+
+    embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_cache: str = "embeddings.sqlite"
+    model: str = "topic_model.pickle"
+
+
 class DataSettings(BaseModel):
     """The data settings."""
 
     topic_fields: list[str]
+    topics: TopicSettings = TopicSettings()
     hierarchy: DataHierarchySettings
     year_field: str
 
@@ -105,8 +156,70 @@ class DataSettings(BaseModel):
 class SearchSettings(BaseModel):
     """The search index settings."""
 
-    url: HttpUrl
-    key: str
+    backend: Literal["meilisearch", "embedded"] = "meilisearch"
+    url: HttpUrl | None = None
+    key: str | None = None
+    path: str = "search"
+    keep: int = 3
+    cache_ttl: float = 300.0
+    cache_size: int = 10000
+    index_check_interval: float = 10.0
+
+    @model_validator(mode="after")
+    def require_meilisearch_access(self):
+        """Require the url and key if the Meilisearch backend is used."""
+        if self.backend == "meilisearch" and (self.url is None or self.key is None):
+            msg = "the meilisearch backend requires the search url and key"
+            raise ValueError(msg)
+        return self
+
+
+class ImageSettings(BaseModel):
+    """The image derivative settings."""
+
+    sizes: list[int] = [240, 320]
+    formats: list[Literal["jpeg", "webp", "avif"]] = ["jpeg"]
+    quality: int = 85
+    progressive: bool = True
+    manifest: str = "images-manifest.sqlite"
+    max_age: int = 10 * 60
+    immutable: bool = False
+
+
+class PublishSettings(BaseModel):
+    """The read-model snapshot settings."""
+
+    path: str = "snapshots"
+    keep: int = 3
+    reload_interval: float = 5.0
+
+    @model_validator(mode="after")
+    def require_current_version(self):
+        """Require that at least the current snapshot version is kept."""
+        if self.keep < 1:
+            msg = "at least one snapshot version must be kept"
+            raise ValueError(msg)
+        return self
+
+
+class ResponseCacheSettings(BaseModel):
+    """The API response cache settings."""
+
+    enabled: bool = True
+    max_size: int = 64 * 1024 * 1024
+    version_check_interval: float = 1.0
+
+
+class TrackingSettings(BaseModel):
+    """The tracking ingestion settings."""
+
+    queue_size: int = 10000
+    batch_size: int = 500
+    flush_interval: float = 2.0
+    user_cache_size: int = 10000
+    partitions_ahead: int = 3
+    retention_months: int = 12
+    archive_path: str = "archive"
 
 
 class Settings(BaseModel):
@@ -117,6 +230,10 @@ class Settings(BaseModel):
     db: DatabaseSettings
     search: SearchSettings
     layout: LayoutSettings
+    images: ImageSettings = ImageSettings()
+    publish: PublishSettings = PublishSettings()
+    response_cache: ResponseCacheSettings = ResponseCacheSettings()
+    tracking: TrackingSettings = TrackingSettings()
 
 
 init_settings = InitSettings()
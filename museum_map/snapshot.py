@@ -0,0 +1,124 @@
+"""Versioned read-model snapshots of the published floors, rooms, floor topics, and items."""
+
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from time import monotonic
+
+from museum_map.settings import settings
+
+logger = logging.getLogger(__name__)
+
+POINTER_NAME = "current"
+EMPTY_LIST = b"[]"
+
+
+def serialise(content):
+    """Serialise the content to JSON bytes, in the same way as the FastAPI JSON responses."""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def snapshot_path(path, version):
+    """Return the path of the snapshot file for the version."""
+    return os.path.join(path, f"snapshot-{version}.json")
+
+
+def write_snapshot(path, version, content, keep=3):
+    """Write the snapshot content and make it the current version, removing all but the latest keep versions."""
+    if keep < 1:
+        msg = "at least the current snapshot version must be kept"
+        raise ValueError(msg)
+    os.makedirs(path, exist_ok=True)
+    target = snapshot_path(path, version)
+    with open(f"{target}.tmp", "wb") as out_f:
+        out_f.write(serialise({"version": version, **content}))
+    os.replace(f"{target}.tmp", target)
+    pointer = os.path.join(path, POINTER_NAME)
+    with open(f"{pointer}.tmp", "w") as out_f:
+        out_f.write(version)
+    os.replace(f"{pointer}.tmp", pointer)
+    versions = sorted(
+        filename[9:-5]
+        for filename in os.listdir(path)
+        if filename.startswith("snapshot-") and filename.endswith(".json")
+    )
+    for old_version in versions[:-keep]:
+        os.unlink(snapshot_path(path, old_version))
+
+
+class Snapshot:
+    """An in-memory snapshot, holding each API response as pre-serialised JSON."""
+
+    def __init__(self, content):
+        """Pre-serialise all responses in the snapshot content."""
+        self.version = content["version"]
+        self.floors = serialise(content["floors"])
+        self.floor_topics = serialise(content["floor_topics"])
+        floor_rooms = defaultdict(list)
+        room_items = defaultdict(list)
+        self.rooms = {}
+        self.items = {}
+        for room in content["rooms"]:
+            floor_rooms[room["floor"]].append(room)
+            self.rooms[room["id"]] = serialise(room)
+        for item in content["items"]:
+            room_items[item["room"]].append(item)
+            self.items[item["id"]] = serialise(item)
+        self.floor_rooms = {floor_id: serialise(rooms) for floor_id, rooms in floor_rooms.items()}
+        self.room_items = {room_id: serialise(items) for room_id, items in room_items.items()}
+        self.item_ids = sorted(self.items)
+
+    @classmethod
+    def load(cls, path):
+        """Load the snapshot from the file."""
+        with open(path, "rb") as in_f:
+            return cls(json.load(in_f))
+
+    def item_list(self, item_ids):
+        """Return the serialised list of the items with the given ids."""
+        return b"[" + b",".join(self.items[item_id] for item_id in item_ids if item_id in self.items) + b"]"
+
+
+class SnapshotStore:
+    """Provides the current snapshot, reloading it when a new snapshot version has been published."""
+
+    def __init__(self, path, reload_interval=5.0):
+        """Initialise the store. Nothing is loaded until the snapshot is first requested."""
+        self._path = path
+        self._reload_interval = reload_interval
+        self._snapshot = None
+        self._last_check = None
+
+    def _current_version(self):
+        """Read the current version from the pointer file."""
+        pointer = os.path.join(self._path, POINTER_NAME)
+        if os.path.exists(pointer):
+            with open(pointer) as in_f:
+                return in_f.read().strip()
+        return None
+
+    async def current(self):
+        """Return the current snapshot or None if no snapshot has been published."""
+        if self._last_check is None or monotonic() - self._last_check >= self._reload_interval:
+            # The check time is updated before reloading, so that concurrent requests continue to use the old snapshot
+            self._last_check = monotonic()
+            await self._reload()
+        return self._snapshot
+
+    async def _reload(self):
+        """Load the current version, if it differs from the loaded snapshot."""
+        try:
+            version = self._current_version()
+            if version is None:
+                self._snapshot = None
+            elif self._snapshot is None or self._snapshot.version != version:
+                # Loading happens in a thread, so that the old snapshot continues to be served in the meantime
+                self._snapshot = await asyncio.to_thread(Snapshot.load, snapshot_path(self._path, version))
+                logger.info(f"Loaded snapshot version {version}")
+        except Exception as e:
+            logger.error(e)
+
+
+store = SnapshotStore(settings.publish.path, settings.publish.reload_interval)